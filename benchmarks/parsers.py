@@ -0,0 +1,62 @@
+# Compares HTML parser backends (BeautifulSoup's tree builders) on the pages cached for tests: time
+# to parse a page and build its text, and whether the results are the same as with the default
+# "html.parser".
+#
+#   python benchmarks/parsers.py [backend ...]
+#
+# (html5lib can be passed, too, but it is much slower, and produces different trees: adds <tbody>
+# to tables, for example.)
+
+import glob
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.normpath(os.path.join(os.path.dirname(__file__), '..')))
+
+from bs4 import FeatureNotFound
+
+from wikipedia_ql.fragment import Fragment
+from wikipedia_ql.parser import Parser
+
+BACKENDS = sys.argv[1:] or ['html.parser', 'lxml']
+PAGES = sorted(glob.glob(os.path.join(os.path.dirname(__file__), '../tests/_cache/*.html')))
+SELECTORS = [
+    Parser().parse_selector(source)
+    for source in ['section >> h2', 'a@href', 'table.wikitable >> tr >> td', 'li >> text:matches("\\d{4}")']
+]
+
+def measure(html, backend):
+    started = time.perf_counter()
+    page = Fragment.parse(html, html_parser=backend)
+    page.text
+    elapsed = time.perf_counter() - started
+    return elapsed, (page.text, page.text_tree.as_tuples(), [page.query(selector) for selector in SELECTORS])
+
+totals = {backend: 0.0 for backend in BACKENDS}
+mismatches = {backend: [] for backend in BACKENDS}
+
+print(f'{"page":40}' + ''.join(f'{backend:>14}' for backend in BACKENDS))
+for path in PAGES:
+    html = open(path).read()
+    reference = None
+    timings = []
+    for backend in BACKENDS:
+        try:
+            elapsed, result = measure(html, backend)
+        except FeatureNotFound:
+            timings.append('not installed')
+            continue
+        reference = reference or result
+        if result != reference:
+            mismatches[backend].append(os.path.basename(path))
+        totals[backend] += elapsed
+        timings.append(f'{elapsed:.3f}s')
+
+    print(f'{os.path.basename(path)[:38]:40}' + ''.join(f'{t:>14}' for t in timings))
+
+print()
+print(f'{"TOTAL":40}' + ''.join(f'{totals[backend]:>13.3f}s' for backend in BACKENDS))
+for backend in BACKENDS:
+    if mismatches[backend]:
+        print(f'{backend}: results differ from {BACKENDS[0]} on {", ".join(mismatches[backend])}')
@@ -0,0 +1,59 @@
+# Compares sentence segmenters on the pages cached for tests: time to split the whole page text into
+# sentences, and how much the boundaries agree with the first one (punkt, by default): precision is the
+# share of the segmenter's boundaries punkt has too, recall is the share of punkt's boundaries found.
+#
+#   python benchmarks/segmenters.py [segmenter ...]
+
+import glob
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.normpath(os.path.join(os.path.dirname(__file__), '..')))
+
+from wikipedia_ql.fragment import Fragment
+from wikipedia_ql.sentences import get_segmenter
+
+SEGMENTERS = sys.argv[1:] or ['punkt', 'regex']
+PAGES = sorted(glob.glob(os.path.join(os.path.dirname(__file__), '../tests/_cache/*.html')))
+
+def measure(text, name):
+    started = time.perf_counter()
+    segmenter = get_segmenter(name)
+    boundaries = set()
+    start = 0
+    for line in text.split('\n'):
+        boundaries.update(start + end for _, end in segmenter.span_tokenize(line))
+        start += len(line) + 1
+    return time.perf_counter() - started, boundaries
+
+# Models are loaded before measuring
+for name in SEGMENTERS:
+    get_segmenter(name)
+
+totals = {name: 0.0 for name in SEGMENTERS}
+matched = {name: 0 for name in SEGMENTERS}
+found = {name: 0 for name in SEGMENTERS}
+expected = 0
+
+print(f'{"page":40}' + ''.join(f'{name:>14}' for name in SEGMENTERS))
+for path in PAGES:
+    text = Fragment.parse(open(path).read()).text
+    timings = []
+    reference = None
+    for name in SEGMENTERS:
+        elapsed, boundaries = measure(text, name)
+        if reference is None:
+            reference = boundaries
+            expected += len(reference)
+        totals[name] += elapsed
+        found[name] += len(boundaries)
+        matched[name] += len(boundaries & reference)
+        timings.append(f'{elapsed:.3f}s')
+
+    print(f'{os.path.basename(path)[:38]:40}' + ''.join(f'{t:>14}' for t in timings))
+
+print()
+print(f'{"TOTAL":40}' + ''.join(f'{totals[name]:>13.3f}s' for name in SEGMENTERS))
+print(f'{"precision":40}' + ''.join(f'{matched[name] / found[name]:>14.1%}' for name in SEGMENTERS))
+print(f'{"recall":40}' + ''.join(f'{matched[name] / expected:>14.1%}' for name in SEGMENTERS))
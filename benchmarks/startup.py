@@ -0,0 +1,48 @@
+# Measures cold start: how long a new process takes to run `wikipedia_ql --help`, and a simple query on
+# a page cached for tests (best of several runs), compared to the targets. Bare Python start is shown
+# for reference: it is the floor for both. tests/test_startup.py checks that the heavy modules
+# which make the difference aren't imported.
+#
+#   python benchmarks/startup.py [runs]
+
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.normpath(os.path.join(os.path.dirname(__file__), '..'))
+RUNS = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+
+QUERY = f'''
+import wikipedia_ql
+wiki = wikipedia_ql.media_wiki.Wikipedia(cache_folder={os.path.join(ROOT, 'tests/_cache')!r}, cache_parsed=False)
+wiki.query('from "Bear" {{ section[heading="Feeding"] >> img@src }}')
+'''
+
+CASES = [
+    # name, command, target (seconds over bare Python start)
+    ('python', [sys.executable, '-c', 'pass'], None),
+    ('--help', [sys.executable, os.path.join(ROOT, 'bin/wikipedia_ql'), '--help'], 0.05),
+    ('cached query', [sys.executable, '-c', QUERY], 0.5),
+]
+
+def measure(command):
+    best = None
+    for _ in range(RUNS):
+        started = time.perf_counter()
+        subprocess.run(command, check=True, stdout=subprocess.DEVNULL, env={**os.environ, 'PYTHONPATH': ROOT})
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+floor = None
+print(f'{"":20}{"time":>10}{"over python":>14}{"target":>10}')
+for name, command, target in CASES:
+    elapsed = measure(command)
+    if floor is None:
+        floor = elapsed
+        print(f'{name:20}{elapsed:>9.3f}s')
+        continue
+    over = elapsed - floor
+    status = 'ok' if over <= target else 'SLOW'
+    print(f'{name:20}{elapsed:>9.3f}s{over:>13.3f}s{target:>9.2f}s  {status}')
@@ -61,6 +61,10 @@ setuptools.setup(
         "pyaml",
         # "nltk-data"
     ],
+    extras_require={
+        # Faster HTML parsing: Wikipedia(html_parser='lxml')
+        "lxml": ["lxml"],
+    },
     scripts=["bin/wikipedia_ql"],
     classifiers=[
         "Development Status :: 3 - Alpha",
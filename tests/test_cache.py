@@ -0,0 +1,140 @@
+from concurrent.futures import ThreadPoolExecutor
+import time
+
+import pytest
+
+from wikipedia_ql.cache import FolderCache, SQLiteCache, MemoryCache
+from wikipedia_ql.media_wiki import Wikipedia
+
+@pytest.fixture(params=['folder', 'sqlite'])
+def cache(request, tmp_path):
+    if request.param == 'folder':
+        return FolderCache(tmp_path / 'cache')
+    else:
+        return SQLiteCache(tmp_path / 'cache.sqlite')
+
+def test_get_put(cache):
+    assert cache.get('Bear', format='html') is None
+
+    cache.put('Bear', '<p>Bear</p>', format='html', revision=123)
+    cache.put('Bear/Paddington?', '<p>Paddington</p>', format='html')
+
+    assert cache.get('Bear', format='html') == '<p>Bear</p>'
+    assert cache.get('Bear', format='json') is None
+    assert cache.get('Bear/Paddington?', format='html') == '<p>Paddington</p>'
+
+    cache.put('Bear', '<p>Bear 2</p>', format='html', revision=124)
+    assert cache.get('Bear', format='html') == '<p>Bear 2</p>'
+
+def test_wikipedia_cache(cache):
+    wiki = Wikipedia(cache=cache)
+
+    wiki.cache_put('Bear.props', json_data={'title': 'Bear'})
+    assert wiki.cache_get('Bear.props') == {'title': 'Bear'}
+
+def test_sqlite_compressed(tmp_path):
+    cache = SQLiteCache(tmp_path / 'cache.sqlite')
+    cache.put('Bear', 'bear ' * 10_000, format='html')
+
+    assert cache.size < 1_000
+    assert cache.get('Bear', format='html') == 'bear ' * 10_000
+
+def test_sqlite_eviction(tmp_path):
+    cache = SQLiteCache(tmp_path / 'cache.sqlite', max_size=2_000)
+    texts = {title: title * 3_000 for title in ['a', 'bc', 'def', 'ghij']}
+
+    cache.put('a', texts['a'], format='html')
+    cache.put('bc', texts['bc'], format='html')
+    cache.get('a', format='html') # now "bc" is the least recently used
+    cache.put('def', texts['def'], format='html')
+
+    # Compressed texts are small, let's make them "large" by tweaking the limit
+    cache.max_size = cache.size - 1
+    cache.evict()
+
+    assert cache.get('bc', format='html') is None
+    assert cache.get('a', format='html') == texts['a']
+    assert cache.get('def', format='html') == texts['def']
+
+def test_sqlite_size(tmp_path):
+    cache = SQLiteCache(tmp_path / 'cache.sqlite')
+    cache.put('a', 'a' * 1_000, format='html')
+    cache.put('b', 'text', format='html')
+    cache.put('a', 'other text', format='html') # replaced
+
+    total, = cache.connection.execute('SELECT SUM(size) FROM entries').fetchone()
+    assert cache.size == total
+
+    cache.max_size = cache.size - 1
+    cache.evict()
+    total, = cache.connection.execute('SELECT SUM(size) FROM entries').fetchone()
+    assert cache.size == total
+
+    # Existing database is picked up with its size
+    assert SQLiteCache(tmp_path / 'cache.sqlite').size == total
+
+def test_sqlite_access_batched(tmp_path):
+    cache = SQLiteCache(tmp_path / 'cache.sqlite')
+    cache.put('a', 'text', format='html')
+
+    def accessed():
+        return cache.connection.execute('SELECT accessed FROM entries WHERE key = ?', ('a',)).fetchone()[0]
+
+    stored = accessed()
+    cache.get('a', format='html')
+    assert accessed() == stored
+
+    cache.put('b', 'text', format='html')
+    assert accessed() > stored
+
+def test_sqlite_threads(tmp_path):
+    cache = SQLiteCache(tmp_path / 'cache.sqlite')
+    for i in range(20):
+        cache.put(f'Page {i}', f'text {i}', format='html')
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        texts = [*executor.map(lambda i: cache.get(f'Page {i}', format='html'), range(20))]
+
+    assert texts == [f'text {i}' for i in range(20)]
+
+def test_sqlite_compression_unknown(tmp_path):
+    with pytest.raises(ValueError):
+        SQLiteCache(tmp_path / 'cache.sqlite', compression='rar')
+
+def test_info(cache):
+    assert cache.info('Bear', format='html') is None
+
+    cache.put('Bear', '<p>Bear</p>', format='html', revision=123, etag='"123/abc"')
+    info = cache.info('Bear', format='html')
+    assert (info['revision'], info['etag']) == (123, '"123/abc"')
+
+    stored = info['stored']
+    time.sleep(0.01)
+    cache.touch('Bear', format='html')
+    assert cache.info('Bear', format='html')['stored'] > stored
+    assert cache.info('Bear', format='html')['revision'] == 123
+
+    cache.touch('Bear', format='html', revision=124)
+    info = cache.info('Bear', format='html')
+    assert (info['revision'], info['etag']) == (124, '"123/abc"')
+
+    cache.put('Bear', '<p>Bear</p>', format='html')
+    info = cache.info('Bear', format='html')
+    assert (info['revision'], info['etag']) == (None, None)
+
+def test_memory_cache():
+    cache = MemoryCache(max_entries=2, max_size=100)
+
+    assert cache.get('a') is None
+    cache.put('a', 'A', size=10)
+    cache.put('b', 'B', size=10)
+    assert cache.get('a') == 'A' # now "b" is least recently used
+    cache.put('c', 'C', size=10)
+
+    assert 'b' not in cache
+    assert (cache.get('a'), cache.get('c')) == ('A', 'C')
+    assert (cache.hits, cache.misses) == (3, 1)
+
+    cache.put('d', 'D', size=95)
+    assert [*cache.entries] == ['d']
+    assert cache.size == 95
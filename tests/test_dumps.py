@@ -0,0 +1,79 @@
+import io
+import json
+import tarfile
+
+import pytest
+
+from wikipedia_ql.dumps import Dump
+from wikipedia_ql.parser import Parser
+
+def record(id, title, html):
+    return {
+        'name': title,
+        'identifier': id,
+        'version': {'identifier': id * 10},
+        'namespace': {'identifier': 0},
+        'url': f'https://en.wikipedia.org/wiki/{title}',
+        'article_body': {
+            'html': f'<html><body class="mw-parser-output">{html}</body></html>',
+            'wikitext': '...'
+        }
+    }
+
+RECORDS = [
+    record(1, 'Bear', '<p>Bears are <a href="./Mammal">mammals</a>.</p>'),
+    record(2, 'Panda', '<p>Pandas are <a href="./Bear">bears</a>.</p>'),
+    record(3, 'Polar bear', '<p>Polar bears are <a href="./Bear">bears</a> too.</p>'),
+]
+
+@pytest.fixture
+def dump_path(tmp_path):
+    path = tmp_path / 'enwiki_namespace_0.tar.gz'
+    with tarfile.open(path, 'w:gz') as tar:
+        for name, records in [('enwiki_0.ndjson', RECORDS[:2]), ('enwiki_1.ndjson', RECORDS[2:])]:
+            data = ''.join(json.dumps(r) + '\n' for r in records).encode('utf-8')
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+    return path
+
+def test_pages(dump_path):
+    pages = [*Dump(dump_path).pages()]
+
+    assert [p.metadata['title'] for p in pages] == ['Bear', 'Panda', 'Polar bear']
+    assert pages[0].metadata['lastrevid'] == 10
+    assert pages[1].query(Parser().parse_selector('a')) == ['bears']
+
+@pytest.mark.parametrize('processes', [1, 2])
+def test_query(dump_path, processes):
+    results = Dump(dump_path).query('a@href', processes=processes, chunksize=2)
+
+    assert [(metadata['title'], result) for metadata, result in results] == [
+        ('Bear', ['https://en.wikipedia.org/wiki/Mammal']),
+        ('Panda', ['https://en.wikipedia.org/wiki/Bear']),
+        ('Polar bear', ['https://en.wikipedia.org/wiki/Bear']),
+    ]
+
+def test_ndjson(tmp_path):
+    path = tmp_path / 'enwiki_0.ndjson'
+    path.write_text(''.join(json.dumps(r) + '\n' for r in RECORDS))
+
+    assert [r['name'] for r in Dump(path).records()] == ['Bear', 'Panda', 'Polar bear']
+
+@pytest.mark.parametrize('processes', [1, 2])
+def test_query_broken_records(tmp_path, caplog, processes):
+    broken = {**record(4, 'Broken', ''), 'article_body': {'html': '<p>No content div</p>'}}
+    path = tmp_path / 'enwiki_0.ndjson'
+    path.write_text(''.join([
+        json.dumps(RECORDS[0]) + '\n',
+        '{"name": "Truncated', '\n',
+        json.dumps(broken) + '\n',
+        json.dumps(RECORDS[1]) + '\n',
+    ]))
+
+    results = Dump(path).query('a@href', processes=processes, chunksize=2)
+
+    assert [metadata['title'] for metadata, _ in results] == ['Bear', 'Panda']
+    assert [r.getMessage().split(' of ')[0] for r in caplog.records] == ['Skipping record #2 (?)', 'Skipping record #3 (Broken)']
+    assert 'JSONDecodeError' in caplog.records[0].getMessage()
+    assert '.mw-parser-output' in caplog.records[1].getMessage()
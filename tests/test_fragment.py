@@ -1,9 +1,12 @@
 import re
 
+import pytest
+
 from bs4 import BeautifulSoup
 
 from wikipedia_ql.fragment import Fragment
 from wikipedia_ql.selectors import text, section, css
+from wikipedia_ql.tag_index import SimpleSelector, parse_simple
 
 def make_fragment(html):
     # Because fragment is Wikipedia-oriented and always looks for this div :shrug:
@@ -14,7 +17,7 @@ def h(html):
 
 def test_build_tree():
     def tree(html):
-        return make_fragment(html).text_tree
+        return make_fragment(html).text_tree.as_tuples()
 
     assert tree("""
             <h2>Header</h2>
@@ -57,6 +60,9 @@ def test_slice():
 
     assert slice(fragment.slice(20, 33), 0, 6) == '<span>th a <a href="foo">l</a></span>'
 
+    # Single character of the node is still included
+    assert slice(fragment, 24, 27) == '<span> <a href="foo">li</a></span>'
+
     fragment = make_fragment("""
         <h2>Section1</h2>
         <p>Text1</p>
@@ -70,4 +76,132 @@ def test_slice():
 
 
 def test_slice_tags():
-    pass
+    fragment = make_fragment("""
+        <h2>Header</h2>
+        <p>Paragraph with a <a href="foo">link</a>.</p>
+        """)
+    h2, p = fragment.soup.select('h2, p')
+
+    # Fragments are views of the page, nothing is copied
+    single = fragment.slice_tags([p])
+    assert single.soup is p
+    assert single.text == 'Paragraph with a link.\n'
+    assert single.slice(17, 21).node is p.a
+
+    several = fragment.slice_tags([h2, p])
+    assert str(several.soup) == '<div><h2>Header</h2>\n<p>Paragraph with a <a href="foo">link</a>.</p></div>'
+    assert several.text == 'Header\n\nParagraph with a link.\n'
+    assert h2.parent is fragment.soup
+
+def test_sentences():
+    fragment = make_fragment("""
+        <p>This is <b>sentence</b> one. This is phrase <a href="foo">two.</a> This is NOT</p>
+        <p>sentence three, probably!</p>
+        """)
+
+    # Derived from the page's sentences, cut by the fragment's boundaries
+    part = fragment.slice(8, 31)
+    assert part.text == 'sentence one. This is p'
+    assert part.sentences == [('sentence one.', 0, 13), ('This is p', 14, 23)]
+
+    # Only the lines asked about are tokenized
+    [index] = fragment.text_tree.indexes.values()
+    assert [*index.lines] == [0]
+    second = fragment.slice_tags([fragment.soup.select('p')[1]])
+    assert next(second.iter_sentences()) == ('sentence three, probably!', 0, 25)
+    assert [*index.lines] == [0, 2]
+
+    assert [text for text, _, _ in fragment.sentences] == \
+        ['This is sentence one.', 'This is phrase two.', 'This is NOT', 'sentence three, probably!']
+
+def test_sections():
+    fragment = make_fragment("""
+        <section><p>Lead</p></section>
+        <section><h2>History</h2><p>Text</p>
+            <section><h3>Early <i>history</i></h3><p>Text</p></section>
+        </section>
+        """)
+
+    [lead, history, early] = fragment.sections()
+    [index] = fragment.text_tree.indexes.values()
+    assert [(s.heading, s.level) for s in index.sections] == [(None, None), ('History', 2), ('Early history', 3)]
+    assert [s.parent for s in index.sections] == [-1, -1, history]
+
+    assert fragment.sections(heading='istory') == [history, early]
+    assert fragment.sections(heading='istory', level=3) == [early]
+    assert fragment.sections(heading='Lead') == []
+    # Found once, then taken from the index
+    assert index.find(heading='istory') is index.find(heading='istory')
+
+    # Only the ones inside the fragment
+    assert fragment.children_fragment(history).sections() == [early]
+    assert fragment.slice(0, 8).sections() == [lead, history]
+
+def test_select_nodes():
+    assert parse_simple('table.wikitable') == (SimpleSelector(name='table', classes=frozenset(['wikitable'])),)
+    assert parse_simple('#toc, LI') == (SimpleSelector(id='toc'), SimpleSelector(name='li'))
+    assert parse_simple('*') == (SimpleSelector(),)
+    assert parse_simple('ul > li') is None
+    assert parse_simple('a[href]') is None
+    assert parse_simple('li:first-child') is None
+
+    fragment = make_fragment("""
+        <p id="first" class="a b">Paragraph with <a href="foo" class="b">link</a> and <b class="a">bold</b>.</p>
+        <ul><li class="a">One <a href="bar">link</a></li><li id="second">Two</li></ul>
+        """)
+
+    def nodes(fragment, css_selector):
+        return [fragment.text_tree.nodes[idx] for idx in fragment.select_nodes(css_selector)]
+
+    # Simple selectors are taken from the index, and give the same as soupsieve, for whole nodes and
+    # parts of them
+    fragments = [
+        fragment, fragment.slice(5, 22), fragment.slice(15, 45),
+        fragment.slice_tags(fragment.soup.select('p, ul')), fragment.slice_tags(fragment.soup.select('li'))
+    ]
+    for part in fragments:
+        for css_selector in ['a', '.a', 'p.b', '.a.b', '#second', 'li#second.a', '*', 'b, a']:
+            assert nodes(part, css_selector) == nodes(part, f':is({css_selector})'), (part.text, css_selector)
+
+    assert [a.get_text() for a in nodes(fragment, 'a')] == ['link', 'link']
+    assert [*fragment.text_tree.indexes] == ['tags']
+
+    assert fragment.slice(15, 19).matches('a.b')
+    assert not fragment.slice(15, 19).matches('a#first')
+
+def test_dump_load():
+    fragment = make_fragment("""
+        <h2 class="first second">Header</h2>
+        <!-- comment -->
+        <p>Paragraph with a <a href="foo">link</a>.<br> And <b>bold</b> text.</p>
+        """)
+
+    data = fragment.dump(source_hash='abc')
+    loaded = Fragment.load(data, source_hash='abc', metadata={'title': 'Test'})
+
+    assert str(loaded.soup) == str(fragment.soup)
+    assert loaded.soup.select_one('h2')['class'] == ['first', 'second']
+    assert loaded.text == fragment.text
+    assert loaded.text_tree.as_tuples() == fragment.text_tree.as_tuples()
+    assert loaded.metadata == {'title': 'Test'}
+    assert str(loaded.slice(20, 33).soup) == str(fragment.slice(20, 33).soup)
+    assert [a.get_text() for a in loaded.soup.find_all(['a', 'b'])] == ['link', 'bold']
+
+    assert Fragment.load(data, source_hash='other') is None
+
+def test_parse_lxml():
+    pytest.importorskip('lxml')
+
+    html = """
+        <div class="mw-parser-output">
+        <h2>Header</h2>
+        <p>Paragraph with a <a href="foo">link</a>.<br> And <b>bold</b>&nbsp;text.</p>
+        <table><tr><td>1</td></tr></table>
+        </div>
+        """
+    default = Fragment.parse(html)
+    lxml = Fragment.parse(html, html_parser='lxml')
+
+    assert lxml.text == default.text
+    assert lxml.text_tree.as_tuples() == default.text_tree.as_tuples()
+    assert str(lxml.soup) == str(default.soup)
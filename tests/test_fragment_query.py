@@ -78,3 +78,66 @@ def test_fragment_query_merging(fragment):
     assert fragment.query(sel('ul >> { @id as "id"; li >> { @id as "id"; text as "value" } }')) == \
         [{'id': 'list'}, {'id': 'li1', 'value': 'First'}, {'id': 'li2', 'value': 'Second text'}]
 
+
+def test_fragment_query_shared_steps(fragment, monkeypatch):
+    from wikipedia_ql.fragment import flatten_and_merge
+
+    queries = [
+        '{ section[heading="Section1"] >> a; section[heading="Section1"] >> b }',
+        '{ section >> a as "a"; section >> b as "b"; section as "s" }',
+        '{ section as "s" >> li >> a; section as "t" >> li >> @id; section >> text:matches("Text\\d") }',
+        '{ section >> { a; b }; section >> li >> text as "li"; ul >> @id as "id"; section >> li as "li2" }',
+        '{ ul >> { @id as "id"; li >> { @id as "id"; text as "value" } }; ul >> li >> @id as "item" }',
+    ]
+    for query in queries:
+        selector = sel(query)
+        # Same as running the branches separately
+        assert fragment.query(selector) == \
+            flatten_and_merge([fragment.query(branch) for branch in selector.selectors]), query
+
+    calls = []
+    original = section.__call__
+    monkeypatch.setattr(section, '__call__', lambda self, fragment: calls.append(self) or original(self, fragment))
+
+    assert fragment.query(sel('{ section[heading="Section1"] >> a; section[heading="Section1"] >> b as "b" }')) == \
+        ['First', 'Second', {'b': 'Text1'}]
+    assert len(calls) == 1
+
+def test_fragment_query_sentences_filter():
+    fragment = make_fragment("""
+        <p>First sentence. Second one with a word.</p>
+        <p>Third sentence.</p>
+        <p>Fourth with a word, too. Fifth.</p>
+        """)
+
+    assert fragment.query(sel('sentence:contains("word")')) == \
+        ['Second one with a word.', 'Fourth with a word, too.']
+    # Lines without the word weren't split into sentences
+    [index] = fragment.text_tree.indexes.values()
+    def tokenized():
+        return [fragment.text[slice(*index.line_span(line))].strip() for line in sorted(index.lines)]
+    assert tokenized() == ['First sentence. Second one with a word.', 'Fourth with a word, too. Fifth.']
+
+    # Anchors depend on the sentence boundaries, so nothing is skipped
+    assert fragment.query(sel('sentence:contains("^T")')) == ['Third sentence.']
+    assert 'Third sentence.' in tokenized()
+
+def test_fragment_iquery(fragment):
+    for query in ['li >> a', 'li >> a as "link"', '{ a.second; text:matches("Fi.{3}") }', 'section >> { h2; b as "b" }']:
+        assert [*fragment.iquery(sel(query))] == fragment.query(sel(query))
+
+    # Merged group is one item
+    query = '{ a.second as "second"; a.first as "first" }'
+    assert [*fragment.iquery(sel(query))] == [fragment.query(sel(query))]
+
+def test_fragment_iquery_lazy(fragment, monkeypatch):
+    queried = []
+    query = Fragment.query
+    def counting_query(self, selector):
+        queried.append(self.text.strip())
+        return query(self, selector)
+    monkeypatch.setattr(Fragment, 'query', counting_query)
+
+    items = fragment.iquery(sel('li as "item" >> a'))
+    assert next(items) == {'item': ['First']}
+    assert queried == ['First']
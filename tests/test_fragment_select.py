@@ -116,9 +116,17 @@ def test_select_section():
         </div>
         """),
     ]
+
+    # All sections, including nested ones
+    assert make_fragment(fragment).query(sel('section >> p')) == \
+        ['Text1', 'Text2', 'Text4', 'Text2', 'Text4', 'Text5']
+
+    assert make_fragment(fragment).query(sel('section:level(3) >> h3')) == ['Section1.1', 'Section1.2']
+    assert make_fragment(fragment).query(sel('section[heading="Section1"]:level(2) >> p')) == \
+        ['Text1', 'Text2', 'Text4']
+    assert make_fragment(fragment).query(sel('section[heading="Section2"]:level(3) >> p')) == []
+
     # TODO:
-    # all
-    # by level
     # intersecting sections?..
     # text pattern (include, start/stop with, regexp)
 
@@ -4,7 +4,7 @@ from wikipedia_ql import media_wiki
 
 @pytest.fixture
 def wiki():
-    return media_wiki.Wikipedia(cache_folder='tests/_cache')
+    return media_wiki.Wikipedia(cache_folder='tests/_cache', cache_parsed=False)
 
 def test_rotten_tomatoes(wiki):
     assert wiki.query(r'''
@@ -0,0 +1,327 @@
+import itertools
+import json
+import time
+
+import pytest
+
+from wikipedia_ql.cache import SQLiteCache
+from wikipedia_ql.fragment import Fragment
+from wikipedia_ql import media_wiki
+from wikipedia_ql.media_wiki import Wikipedia, bounded_map
+from wikipedia_ql.scheduler import Scheduler
+
+def test_bounded_map_ordered():
+    def slow_square(x):
+        time.sleep(0.01 * (5 - x))
+        return x * x
+
+    assert [*bounded_map(slow_square, range(5), workers=3)] == [0, 1, 4, 9, 16]
+    assert [*bounded_map(slow_square, range(5), workers=1)] == [0, 1, 4, 9, 16]
+
+def test_bounded_map_unordered():
+    def slow_square(x):
+        time.sleep(0.02 * (3 - x))
+        return x * x
+
+    assert sorted(bounded_map(slow_square, range(3), workers=3, ordered=False)) == [0, 1, 4]
+    assert [*bounded_map(slow_square, range(3), workers=3, ordered=False)][0] == 4
+
+def test_bounded_map_lazy():
+    consumed = []
+    def items():
+        for i in itertools.count():
+            consumed.append(i)
+            yield i
+
+    assert [*itertools.islice(bounded_map(lambda x: x, items(), workers=2), 3)] == [0, 1, 2]
+    assert len(consumed) <= 3 + 2 * 2
+
+class FakeResponse:
+    def __init__(self, data):
+        self.content = json.dumps(data).encode('utf-8')
+
+def test_get_metadata_batched(tmp_path, monkeypatch):
+    wiki = Wikipedia(cache_folder=tmp_path)
+    wiki.cache_put('Cached.props', json_data={'pageid': 1, 'ns': 0, 'title': 'Cached'})
+
+    requests = []
+    def query_get(**params):
+        titles = params['titles'].split('|')
+        requests.append(titles)
+        return FakeResponse({'query': {
+            'normalized': [{'from': 'foo_bar', 'to': 'Foo bar'}],
+            'redirects': [{'from': 'Foo bar', 'to': 'Foo'}],
+            'pages': {
+                '2': {'pageid': 2, 'ns': 0, 'title': 'Foo'},
+                '-1': {'ns': 0, 'title': 'Absent', 'missing': ''},
+                **{str(10 + i): {'pageid': 10 + i, 'ns': 0, 'title': f'Page {i}'} for i in range(60)}
+            }
+        }})
+    monkeypatch.setattr(wiki, '_Wikipedia__query_get', query_get)
+
+    titles = ['Cached', 'foo_bar', 'Absent', *(f'Page {i}' for i in range(60))]
+    metadata = [*wiki.get_metadata(titles)]
+
+    assert [m['title'] for m in metadata] == ['Cached', 'Foo', 'Absent', *(f'Page {i}' for i in range(60))]
+    assert 'missing' in metadata[2]
+    assert [len(r) for r in requests] == [49, 13]
+
+    # Now everything is cached
+    requests.clear()
+    assert [m['title'] for m in wiki.get_metadata(['foo_bar', 'Page 59'])] == ['Foo', 'Page 59']
+    assert requests == []
+
+def test_get_category_members(monkeypatch):
+    wiki = Wikipedia()
+
+    listings = {
+        ('Category:Top', None): {
+            'continue': {'gcmcontinue': 'page2', 'continue': 'gcmcontinue||'},
+            'query': {'pages': {
+                '1': {'pageid': 1, 'ns': 0, 'title': 'A'},
+                '100': {'pageid': 100, 'ns': 14, 'title': 'Category:Sub'},
+            }}
+        },
+        ('Category:Top', 'page2'): {
+            'query': {'pages': {
+                '2': {'pageid': 2, 'ns': 0, 'title': 'B'},
+            }}
+        },
+        ('Category:Sub', None): {
+            'query': {'pages': {
+                '2': {'pageid': 2, 'ns': 0, 'title': 'B'},
+                '3': {'pageid': 3, 'ns': 0, 'title': 'C'},
+                '101': {'pageid': 101, 'ns': 14, 'title': 'Category:Top'},
+                '102': {'pageid': 102, 'ns': 14, 'title': 'Category:Deeper'},
+            }}
+        },
+        ('Category:Deeper', None): {
+            'query': {'pages': {
+                '4': {'pageid': 4, 'ns': 0, 'title': 'D'},
+            }}
+        },
+    }
+    requests = []
+    def query_get(**params):
+        requests.append((params['gcmtitle'], params['gcmnamespace']))
+        namespaces = [int(ns) for ns in str(params['gcmnamespace']).split('|')]
+        listing = listings[(params['gcmtitle'], params.get('gcmcontinue'))]
+        pages = {id: page for id, page in listing['query']['pages'].items() if page['ns'] in namespaces}
+        return FakeResponse({**listing, 'query': {'pages': pages}})
+    monkeypatch.setattr(wiki, '_Wikipedia__query_get', query_get)
+
+    assert [m['title'] for m in wiki.get_category_members('Top')] == ['A', 'B']
+    assert requests == [('Category:Top', 0), ('Category:Top', 0)]
+
+    requests.clear()
+    assert [m['title'] for m in wiki.get_category_members('Top', depth=1)] == ['A', 'B', 'C']
+    assert requests == [('Category:Top', '0|14'), ('Category:Top', '0|14'), ('Category:Sub', 0)]
+
+    assert [m['title'] for m in wiki.get_category_members('Top', depth=5)] == ['A', 'B', 'C', 'D']
+
+    # Streaming: the second listing page isn't requested until the first one is exhausted
+    requests.clear()
+    members = wiki.get_category_members('Top')
+    next(members)
+    assert requests == [('Category:Top', 0)]
+
+def test_session():
+    wiki = Wikipedia(workers=8, retries=5)
+    adapter = wiki.session.get_adapter(Wikipedia.API_URI)
+
+    assert adapter is wiki.session.get_adapter(Wikipedia.PARSOID_API_URI)
+    assert adapter._pool_maxsize == 8
+    assert adapter.max_retries.total == 5
+    assert 503 in adapter.max_retries.status_forcelist
+
+class FakePageResponse:
+    def __init__(self, status_code, text='', etag=None):
+        self.status_code = status_code
+        self.content = text.encode('utf-8')
+        self.headers = {'ETag': etag} if etag else {}
+
+@pytest.fixture
+def revalidated_wiki(tmp_path, monkeypatch):
+    wiki = Wikipedia(cache=SQLiteCache(tmp_path / 'cache.sqlite'), revalidate='always')
+    wiki.cache_put('Bear.props', json_data={'pageid': 1, 'ns': 0, 'title': 'Bear', 'lastrevid': 10})
+    wiki.cache_put('Bear', text=PAGE_HTML.format('Old'), format='html', revision=10, etag='"10/abc"')
+
+    wiki.log = []
+    wiki.current_revision = 10
+
+    def query_get(**params):
+        wiki.log.append(('query', params['titles']))
+        return FakeResponse({'query': {'pages': {
+            '1': {'pageid': 1, 'ns': 0, 'title': 'Bear', 'lastrevid': wiki.current_revision}
+        }}})
+
+    def page_get(title, *, etag=None):
+        wiki.log.append(('page', title, etag))
+        if etag == f'"{wiki.current_revision}/abc"':
+            return FakePageResponse(304)
+        return FakePageResponse(200, PAGE_HTML.format('New'), f'"{wiki.current_revision}/abc"')
+
+    monkeypatch.setattr(wiki, '_Wikipedia__query_get', query_get)
+    monkeypatch.setattr(wiki, '_Wikipedia__page_get', page_get)
+    return wiki
+
+PAGE_HTML = '<div class="mw-parser-output"><p>{}</p></div>'
+
+def test_revalidate_unchanged(revalidated_wiki):
+    wiki = revalidated_wiki
+
+    assert wiki.get_page('Bear').query('p') == ['Old']
+    assert wiki.log == [('query', 'Bear')]
+
+def test_revalidate_changed(revalidated_wiki):
+    wiki = revalidated_wiki
+    wiki.current_revision = 11
+
+    assert [*wiki.get_pages(['Bear'])][0].query('p') == ['New']
+    assert wiki.log == [('query', 'Bear'), ('page', 'Bear', '"10/abc"')]
+    assert wiki.cache.info('Bear', format='html')['revision'] == 11
+
+def test_revalidate_not_modified(revalidated_wiki):
+    wiki = revalidated_wiki
+    # Revision unknown for the cached page
+    wiki.cache_put('Bear', text=PAGE_HTML.format('Old'), format='html', etag='"10/abc"')
+
+    assert wiki.get_page('Bear').query('p') == ['Old']
+    assert wiki.log == [('query', 'Bear'), ('page', 'Bear', '"10/abc"')]
+    assert wiki.cache.info('Bear', format='html')['revision'] == 10
+
+    # Now the revision is known, so the next revalidation doesn't need a conditional request
+    wiki.memory_cache = None
+    wiki.log.clear()
+    assert wiki.get_page('Bear').query('p') == ['Old']
+    assert wiki.log == [('query', 'Bear')]
+
+def test_revalidate_ttl(revalidated_wiki):
+    wiki = revalidated_wiki
+    wiki.current_revision = 11
+    wiki.revalidate = 3600
+
+    assert wiki.get_page('Bear').query('p') == ['Old']
+    assert wiki.log == []
+
+def test_parsed_page_cache(tmp_path, monkeypatch):
+    wiki = Wikipedia(cache=SQLiteCache(tmp_path / 'cache.sqlite'), memory_cache=False)
+    wiki.cache_put('Bear.props', json_data={'pageid': 1, 'ns': 0, 'title': 'Bear'})
+    wiki.cache_put('Bear', text=PAGE_HTML.format('Bear'), format='html')
+
+    assert wiki.get_page('Bear').query('p') == ['Bear']
+    assert wiki.cache_get('Bear', format='parsed')
+
+    def fail(*args, **kwargs):
+        raise AssertionError('Should not be parsed again')
+    monkeypatch.setattr(Fragment, 'parse', fail)
+
+    assert wiki.get_page('Bear').query('p') == ['Bear']
+
+    # Changed HTML is parsed again
+    monkeypatch.undo()
+    wiki.cache_put('Bear', text=PAGE_HTML.format('Bear 2'), format='html')
+    assert wiki.get_page('Bear').query('p') == ['Bear 2']
+
+def test_memory_cache(tmp_path, monkeypatch):
+    wiki = Wikipedia(cache=SQLiteCache(tmp_path / 'cache.sqlite'))
+    wiki.cache_put('Bear.props', json_data={'pageid': 1, 'ns': 0, 'title': 'Bear', 'lastrevid': 10})
+    wiki.cache_put('Bear', text=PAGE_HTML.format('Bear'), format='html')
+
+    page = wiki.get_page('Bear')
+
+    cache_get = wiki.cache_get
+    def page_cache_get(key, *, format='json'):
+        assert format == 'json', 'Page should not be read from the cache anymore'
+        return cache_get(key, format=format)
+    monkeypatch.setattr(wiki, 'cache_get', page_cache_get)
+
+    assert wiki.get_page('Bear') is page
+    assert [*wiki.get_pages(['Bear'])] == [page]
+    assert (wiki.memory_cache.hits, wiki.memory_cache.misses) == (2, 1)
+
+    assert [*wiki.memory_cache.entries] == [('Bear', 10)]
+    assert wiki.memory_cache.size == len(PAGE_HTML.format('Bear')) * Wikipedia.PARSED_SIZE_RATIO
+
+def test_memory_cache_size(tmp_path):
+    wiki = Wikipedia(cache=SQLiteCache(tmp_path / 'cache.sqlite'))
+    wiki.memory_cache.max_size = len(PAGE_HTML.format('Bear')) * Wikipedia.PARSED_SIZE_RATIO * 2
+    for title in ['Bear', 'Wolf', 'Fox']:
+        wiki.cache_put(f'{title}.props', json_data={'pageid': 1, 'ns': 0, 'title': title})
+        wiki.cache_put(title, text=PAGE_HTML.format(title[:3]), format='html')
+        wiki.get_page(title)
+
+    assert [*wiki.memory_cache.entries] == [('Wolf', None), ('Fox', None)]
+
+def test_stream(tmp_path, monkeypatch):
+    wiki = Wikipedia(cache=SQLiteCache(tmp_path / 'cache.sqlite'))
+    for title in ['Bear', 'Wolf']:
+        wiki.cache_put(f'{title}.props', json_data={'pageid': 1, 'ns': 0, 'title': title})
+        wiki.cache_put(title, text=PAGE_HTML.format(f'{title} 1</p><p>{title} 2'), format='html')
+
+    assert [*wiki.stream('from "Bear" { p }')] == ['Bear 1', 'Bear 2']
+    assert [*wiki.stream('p', page='Bear')] == ['Bear 1', 'Bear 2']
+
+    fetched = []
+    def get_category(title, *, depth=0, ordered=True):
+        for page in ['Bear', 'Wolf']:
+            fetched.append(page)
+            yield wiki.get_page(page)
+    monkeypatch.setattr(wiki, 'get_category', get_category)
+
+    items = wiki.stream('from category:"Animals" { p }')
+    assert [next(items), next(items)] == ['Bear 1', 'Bear 2']
+    assert fetched == ['Bear']
+    assert [*items] == ['Wolf 1', 'Wolf 2']
+
+@pytest.mark.parametrize('processes', [None, 2])
+def test_query_in_processes(tmp_path, monkeypatch, processes):
+    wiki = Wikipedia(cache=SQLiteCache(tmp_path / 'cache.sqlite'), processes=processes, chunksize=2)
+    titles = ['Bear', 'Wolf', 'Fox']
+    for title in titles:
+        wiki.cache_put(f'{title}.props', json_data={'pageid': 1, 'ns': 0, 'title': title})
+        wiki.cache_put(title, text=PAGE_HTML.format(f'{title} 1</p><p>{title} 2'), format='html')
+    wiki.cache_put('Absent.props', json_data={'ns': 0, 'title': 'Absent', 'missing': ''})
+
+    assert [*wiki.iquery_pages(['Wolf', 'Absent', 'Bear', 'Fox'], 'p')] == \
+        [['Wolf 1', 'Wolf 2'], ['Bear 1', 'Bear 2'], ['Fox 1', 'Fox 2']]
+
+    monkeypatch.setattr(wiki, 'get_category_members', lambda category, depth: wiki.get_metadata(titles))
+    assert wiki.query('from category:"Animals" { p:first-child as "first" }') == \
+        [[{'first': 'Bear 1'}], [{'first': 'Wolf 1'}], [{'first': 'Fox 1'}]]
+    # Pre-parsed pages are stored by the workers, too
+    assert all(wiki.cache_get(title, format='parsed') for title in titles)
+
+    assert [*wiki.stream('from category:"Animals" { p:first-child as "first" }')] == \
+        [{'first': 'Bear 1'}, {'first': 'Wolf 1'}, {'first': 'Fox 1'}]
+    assert [*wiki.stream('from category:"Animals" { p:first-child as "first"; p:last-child as "last" }')] == \
+        [{'first': 'Bear 1', 'last': 'Bear 2'}, {'first': 'Wolf 1', 'last': 'Wolf 2'}, {'first': 'Fox 1', 'last': 'Fox 2'}]
+
+@pytest.mark.parametrize('processes', [None, 2])
+def test_query_category_missing_page(tmp_path, monkeypatch, processes):
+    wiki = Wikipedia(cache=SQLiteCache(tmp_path / 'cache.sqlite'), processes=processes, revalidate='always')
+    titles = ['Bear', 'Wolf', 'Fox']
+    for title in titles:
+        wiki.cache_put(title, text=PAGE_HTML.format(title), format='html', revision=10)
+    members = [{'pageid': 1, 'ns': 0, 'title': title, 'lastrevid': 10} for title in titles]
+    monkeypatch.setattr(wiki, 'get_category_members', lambda category, depth: iter(members))
+
+    # Wolf was deleted since the category was listed
+    def query_get(**params):
+        return FakeResponse({'query': {'pages': {
+            str(i): {'pageid': 1, 'ns': 0, 'title': title, 'lastrevid': 10}
+            for i, title in enumerate(params['titles'].split('|')) if title != 'Wolf'
+        }}})
+    monkeypatch.setattr(wiki, '_Wikipedia__query_get', query_get)
+
+    assert wiki.query('from category:"Animals" { p }') == [['Bear'], ['Fox']]
+    assert [*wiki.iquery('from category:"Animals" { p }')] == [['Bear'], ['Fox']]
+
+def test_worker_scheduler(monkeypatch):
+    wiki = Wikipedia(processes=4, scheduler=Scheduler(rate=8))
+    monkeypatch.setattr(media_wiki, '_worker', {})
+    # What a worker process does on start
+    media_wiki._init_worker(wiki._worker_options(), wiki.scheduler.share(wiki.processes), None)
+
+    # Workers split the rate between them
+    assert media_wiki._worker['wikipedia'].scheduler.rate(Wikipedia.API_URI) == 2
@@ -1,7 +1,8 @@
+import lark
 import pytest
 
 from wikipedia_ql.selectors import text, text_group, sentence, section, css, alt, page, attr, table_data
-from wikipedia_ql.parser import Parser
+from wikipedia_ql.parser import Parser, parse_cached
 
 @pytest.fixture
 def parser():
@@ -53,3 +54,36 @@ def test_full_query(parser):
 
     assert parser.parse('from category:"Marvel Cinematic Universe films" { text:matches("Rotten") }') == \
         ("category", "Marvel Cinematic Universe films", text(functions={'matches' "Rotten"}))
+
+def test_parse_css(parser):
+    assert parser.parse_selector('table.wikitable') == css(attrs={'css_selector': 'table.wikitable'})
+    assert parser.parse_selector('li:nth-child(2) as "x"') == css(attrs={'css_selector': 'li:nth-child(2)'}, name='x')
+    assert parser.parse_selector('td[column="col 1"] >> a') == \
+        css(attrs={'css_selector': 'td[column="col 1"]'}, nested=css(attrs={'css_selector': 'a'}))
+
+    # Selector names are only recognized as a whole word
+    assert parser.parse_selector('textarea') == css(attrs={'css_selector': 'textarea'})
+    assert parser.parse_selector('section.foo') == css(attrs={'css_selector': 'section.foo'})
+    assert parser.parse_selector('sections') == css(attrs={'css_selector': 'sections'})
+    assert parser.parse_selector('text-group[group=1]') == text_group(attrs={'group': 1})
+
+    with pytest.raises(lark.exceptions.UnexpectedInput):
+        parser.parse_selector('ul li')
+
+def test_parse_cached(parser):
+    source = 'section[heading="foo"] >> { a; text }'
+    assert parser.parse_selector(source) == Parser().parse_selector(source)
+    assert parse_cached.cache_info().hits > 0
+    assert parser.lark is Parser().lark
+
+    # Every caller gets its own copy
+    selector = parser.parse_selector(source)
+    selector.attrs['heading'] = 'bar'
+    selector.nested.selectors = selector.nested.selectors[:1]
+    assert parser.parse_selector(source) == section(
+        attrs={'heading': 'foo'}, nested=alt(css(attrs={'css_selector': 'a'}), text())
+    )
+
+    query = parser.parse(f'from "Bear" {{ {source} }}')
+    query[2].attrs['heading'] = 'bar'
+    assert parser.parse(f'from "Bear" {{ {source} }}')[2].attrs == {'heading': 'foo'}
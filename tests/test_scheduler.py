@@ -0,0 +1,121 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import threading
+import time
+import urllib.parse
+
+import pytest
+import requests
+
+from wikipedia_ql.media_wiki import Wikipedia
+from wikipedia_ql.scheduler import Scheduler, TokenBucket, retry_after
+
+class FakeResponse:
+    def __init__(self, status_code=200, headers={}):
+        self.status_code = status_code
+        self.headers = headers
+
+def test_token_bucket():
+    bucket = TokenBucket(20)
+    started = time.monotonic()
+    for _ in range(5):
+        bucket.take()
+    assert time.monotonic() - started >= 0.15
+
+    bucket.pause(0.1)
+    started = time.monotonic()
+    bucket.take()
+    assert time.monotonic() - started >= 0.1
+
+def test_scheduler_adapts():
+    scheduler = Scheduler(rate=10, max_concurrency=4, default_pause=0)
+    uri = 'https://en.wikipedia.org/w/api.php'
+
+    assert scheduler.observe(uri, FakeResponse(429), 0.1) == True
+    assert scheduler.rates == {'en.wikipedia.org': 5}
+    assert scheduler.concurrency == 2
+
+    assert scheduler.observe(uri, FakeResponse(200, {'MediaWiki-API-Error': 'maxlag'}), 0.1) == True
+    assert scheduler.rate(uri) == 2.5
+    assert scheduler.concurrency == 1
+
+    for _ in range(10):
+        assert scheduler.observe(uri, FakeResponse(200), 0.1) == False
+    assert scheduler.rate(uri) == pytest.approx(3.5)
+    assert scheduler.concurrency == 2
+
+    scheduler.observe(uri, FakeResponse(200), 10)
+    assert scheduler.concurrency == 1
+
+    # Other hosts are limited separately
+    assert scheduler.rate('https://upload.wikimedia.org/') == 10
+
+def test_retry_after():
+    assert retry_after(FakeResponse(429, {'Retry-After': '3'}), 1) == 3
+    assert retry_after(FakeResponse(429, {'Retry-After': 'Wed, 21 Oct 2015 07:28:00 GMT'}), 1) == 0
+    assert retry_after(FakeResponse(429, {'Retry-After': 'soon'}), 1) == 1
+    assert retry_after(FakeResponse(429), 1) == 1
+
+@pytest.fixture
+def server():
+    received = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            query = urllib.parse.parse_qs(urllib.parse.urlparse(self.path).query)
+            received.append(query)
+            if len(received) == 1:
+                self.send_response(429)
+                self.send_header('Retry-After', '0')
+                self.end_headers()
+                return
+
+            title = query['titles'][0]
+            body = json.dumps({'query': {'pages': {'1': {'pageid': 1, 'ns': 0, 'title': title}}}})
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.end_headers()
+            self.wfile.write(body.encode('utf-8'))
+
+        def log_message(self, *args):
+            pass
+
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{httpd.server_port}/w/api.php', received
+    httpd.shutdown()
+
+def test_throttled_request(server):
+    uri, received = server
+    wiki = Wikipedia()
+    wiki.API_URI = uri
+
+    assert [*wiki.get_metadata(['Bear'])] == [{'pageid': 1, 'ns': 0, 'title': 'Bear'}]
+    assert len(received) == 2
+    assert received[0]['maxlag'] == ['5']
+    assert wiki.scheduler.rate(uri) < 10
+
+def test_throttled_request_gives_up():
+    class ThrottlingSession:
+        def __init__(self):
+            self.requests = 0
+
+        def get(self, uri, **kwargs):
+            self.requests += 1
+            return FakeResponse(200, {'MediaWiki-API-Error': 'maxlag'})
+
+    session = ThrottlingSession()
+    wiki = Wikipedia(session=session, retries=2, scheduler=Scheduler(default_pause=0))
+
+    with pytest.raises(requests.HTTPError, match='still throttled after 3 attempts'):
+        [*wiki.get_metadata(['Bear'])]
+    assert session.requests == 3
+
+def test_scheduler_share():
+    scheduler = Scheduler(rate=10, max_rate=40, max_concurrency=4)
+    share = Scheduler(**scheduler.share(4))
+
+    assert share.rate('https://en.wikipedia.org/') == 2.5
+    assert share.max_rate == 10
+    assert share.max_concurrency == 1
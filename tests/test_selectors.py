@@ -1,3 +1,7 @@
+import pickle
+
+import pytest
+
 from dataclasses import dataclass
 from wikipedia_ql.selectors import text, sentence, section, css, alt
 from wikipedia_ql.parser import Parser
@@ -25,3 +29,37 @@ def test_repr():
         r'{ text:contains(".{4,10}") as "txt"; text:contains("\\s{2}") as "space" }') == \
         "section[heading='Section 1'] as 'section' >> css[css_selector='li.foo'] as 'item' >> " + \
         r"{ text:contains('.{4,10}') as 'txt'; text:contains('\\\\s{2}') as 'space' }"
+
+def test_compile():
+    selector = Parser().parse_selector(
+        '{ section[heading="Section 1"] >> li.foo >> text:matches("a+") as "text"; img@style-width }'
+    )
+    plan = selector.compile()
+
+    # Same selectors, with everything prepared once
+    assert plan == selector
+    assert plan.compile() is plan
+    assert not selector.compiled and not selector.selectors[0].compiled
+
+    text_plan = plan.selectors[0].nested.nested
+    assert text_plan.re.pattern == 'a+'
+    assert plan.selectors[0].nested.selector.pattern == 'li.foo'
+    assert plan.selectors[1].nested.style_re.search('width: 10px').group(1) == '10px'
+
+    with pytest.raises(AttributeError):
+        text_plan.name = 'other'
+    assert text_plan.name == 'text'
+
+    # What the plan was prepared from can't be changed either
+    with pytest.raises(TypeError):
+        text_plan.functions['matches'] = 'b+'
+    with pytest.raises(TypeError):
+        plan.selectors[0].attrs['heading'] = 'Section 2'
+    assert text_plan.functions == {'matches': 'a+'}
+
+    # Plans are sent to worker processes
+    unpickled = pickle.loads(pickle.dumps(plan))
+    assert unpickled == plan
+    assert unpickled.selectors[0].nested.nested.re.pattern == 'a+'
+    with pytest.raises(TypeError):
+        unpickled.selectors[0].attrs['heading'] = 'Section 2'
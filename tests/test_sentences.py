@@ -0,0 +1,43 @@
+from wikipedia_ql.fragment import Fragment
+from wikipedia_ql.media_wiki import Wikipedia
+from wikipedia_ql.sentences import RegexSegmenter
+
+def split(text):
+    return [text[s:e] for s, e in RegexSegmenter().span_tokenize(text)]
+
+def test_regex_segmenter():
+    assert split(' One sentence. Another one!  "Quoted?" And more') == \
+        ['One sentence.', 'Another one!', '"Quoted?"', 'And more']
+
+    # Abbreviations, initials, decimals
+    assert split('Dr. Smith paid $3.50 for it, e.g. on Jan. 3. J. R. R. Tolkien and the U.S. Army did not.') == \
+        ['Dr. Smith paid $3.50 for it, e.g. on Jan. 3.', 'J. R. R. Tolkien and the U.S. Army did not.']
+
+    # Citations and lowercase continuations
+    assert split('It was released in 1999.[1][a] Critics... were harsh.[citation needed] (See below.) Done') == \
+        ['It was released in 1999.[1][a]', 'Critics... were harsh.[citation needed]', '(See below.)', 'Done']
+
+def test_fragment_segmenter():
+    wikipedia = Wikipedia(segmenter='regex')
+    fragment = Fragment.parse(
+        '<div class="mw-parser-output"><p>Born in the U.S. in 1990. Moved to the U.K. later.</p></div>',
+        media_wiki=wikipedia
+    )
+    assert [text for text, _, _ in fragment.sentences] == ['Born in the U.S. in 1990.', 'Moved to the U.K. later.']
+
+class LineSegmenter:
+    # Like punkt on a line starting with a space: the whitespace is included in the sentence
+    def span_tokenize(self, text):
+        if text.strip():
+            yield (0, len(text))
+
+def test_fragment_sentences_whitespace():
+    wikipedia = Wikipedia(segmenter=LineSegmenter())
+    fragment = Fragment.parse(
+        '<div class="mw-parser-output"><p>First.</p>\n<p> The second.</p></div>',
+        media_wiki=wikipedia
+    )
+    # Sentences are taken as the segmenter reports them, not trimmed
+    assert [text for text, _, _ in fragment.sentences] == ['First.', ' The second.']
+    assert fragment.query(wikipedia.parser.parse_selector('sentence:contains("^The")')) == []
+    assert fragment.query(wikipedia.parser.parse_selector('sentence:contains("^ The")')) == ['The second.']
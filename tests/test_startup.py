@@ -0,0 +1,48 @@
+import json
+import os
+import subprocess
+import sys
+
+# Heavy dependencies are imported only when they are needed; see benchmarks/startup.py for the timings
+# that depend on it.
+
+ROOT = os.path.normpath(os.path.join(os.path.dirname(__file__), '..'))
+HEAVY = ['nltk', 'yaml', 'requests', 'bs4', 'soupsieve', 'lark']
+
+def imported_after(code):
+    script = f'import sys\n{code}\nprint(__import__("json").dumps([m for m in {HEAVY!r} if m in sys.modules]))'
+    result = subprocess.run(
+        [sys.executable, '-c', script],
+        check=True, capture_output=True, text=True, cwd=ROOT, env={**os.environ, 'PYTHONPATH': ROOT}
+    )
+    return json.loads(result.stdout.splitlines()[-1])
+
+def test_import():
+    assert imported_after('import wikipedia_ql') == []
+
+def test_help():
+    assert imported_after('''
+import wikipedia_ql
+sys.argv = ['wikipedia_ql', '--help']
+try:
+    wikipedia_ql.run()
+except SystemExit:
+    pass
+''') == []
+
+def test_cached_query():
+    # No network, no sentences, no YAML
+    assert imported_after('''
+import wikipedia_ql
+wiki = wikipedia_ql.media_wiki.Wikipedia(cache_folder='tests/_cache', cache_parsed=False)
+assert wiki.query('from "Bear" { section[heading="Feeding"] >> img@src }')
+''') == ['bs4', 'soupsieve', 'lark']
+
+def test_run_after_submodule_import():
+    # Importing the submodule doesn't replace the function in the package
+    assert imported_after('''
+import wikipedia_ql.run
+from wikipedia_ql import run as module
+assert callable(wikipedia_ql.run), wikipedia_ql.run
+assert callable(module), module
+''') == []
@@ -2,7 +2,16 @@ __version__ = '0.17.0'
 __license__ = 'MIT'
 __author__ = 'Victor Shepelev'
 
+import importlib
+
+# run only imports what it needs when it is called, so importing it is cheap
 from .run import run
-from . import media_wiki
 
 __all__ = ['run', 'media_wiki']
+
+# media_wiki (and everything heavy it needs) is imported on first use, so that `import wikipedia_ql`
+# (and `wikipedia_ql --help`) is fast; see tests/test_startup.py
+def __getattr__(name):
+    if name == 'media_wiki':
+        return importlib.import_module('.media_wiki', __name__)
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
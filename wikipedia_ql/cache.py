@@ -0,0 +1,264 @@
+from collections import OrderedDict
+import importlib
+import json
+import os
+from pathlib import Path
+import re
+import sqlite3
+import threading
+import time
+
+# Cache backends store text (page HTML, JSON-serialized metadata) or binary data (pre-parsed pages)
+# by key (page title) and format.
+# Along with the data, the revision of the page and the ETag of the response it was received with
+# are stored, so it can be revalidated later; info() returns them, along with the time when the
+# entry was stored or last confirmed to be fresh (touch(), which can also update the revision).
+
+class FolderCache:
+    """
+    The simplest cache: one plain-text file per entry in the specified folder. Revision and ETag,
+    if known, are stored in an additional ``.info`` file.
+    """
+    def __init__(self, folder):
+        self.folder = Path(folder)
+        self.folder.mkdir(exist_ok=True, parents=True)
+
+    def get(self, key, *, format, binary=False):
+        path = self._path(key, format)
+        if path.exists():
+            return path.read_bytes() if binary else path.read_text()
+
+    def put(self, key, data, *, format, revision=None, etag=None):
+        if isinstance(data, bytes):
+            self._path(key, format).write_bytes(data)
+        else:
+            self._path(key, format).write_text(data)
+        info_path = self._path(key, format + '.info')
+        if revision is not None or etag is not None:
+            info_path.write_text(json.dumps({'revision': revision, 'etag': etag}))
+        elif info_path.exists():
+            info_path.unlink()
+
+    def info(self, key, *, format):
+        path = self._path(key, format)
+        if not path.exists():
+            return None
+
+        info_path = self._path(key, format + '.info')
+        info = json.loads(info_path.read_text()) if info_path.exists() else {'revision': None, 'etag': None}
+        return {**info, 'stored': path.stat().st_mtime}
+
+    def touch(self, key, *, format, revision=None):
+        os.utime(self._path(key, format))
+        if revision is not None:
+            info_path = self._path(key, format + '.info')
+            info = json.loads(info_path.read_text()) if info_path.exists() else {'etag': None}
+            info_path.write_text(json.dumps({**info, 'revision': revision}))
+
+    def _path(self, key, format):
+        key = re.sub(r'[?\/&]', '-', key)
+        return self.folder.joinpath(f'{key}.{format}')
+
+
+class SQLiteCache:
+    """
+    Single-file cache: entries are stored compressed (with ``zlib``, or ``zstd`` if ``zstandard`` package
+    is installed and ``compression='zstd'`` is passed) in SQLite database, along with the page revision
+    they belong to.
+
+    With ``max_size`` (in bytes of compressed data) set, least recently used entries are evicted when
+    the cache grows over it. Can be used from several threads and processes at once.
+    """
+    # Reading entries doesn't write their access times immediately (that would take the database's
+    # write lock on every read); they are remembered and written with the next put, or when there
+    # are this many of them.
+    ACCESS_BATCH = 256
+
+    def __init__(self, path, *, max_size=None, compression='zlib'):
+        self.path = Path(path)
+        self.path.parent.mkdir(exist_ok=True, parents=True)
+        self.max_size = max_size
+        self.compression = compression
+        if compression not in CODECS:
+            raise ValueError(f'Unsupported compression {compression!r}')
+        # Fail early if zstandard is not installed
+        self._codec(compression)
+
+        self.local = threading.local()
+        self.accessed = {}
+        self.accessed_lock = threading.Lock()
+        with self.connection as db:
+            db.execute('''
+                CREATE TABLE IF NOT EXISTS entries (
+                    key TEXT NOT NULL,
+                    format TEXT NOT NULL,
+                    revision INTEGER,
+                    etag TEXT,
+                    codec TEXT NOT NULL,
+                    data BLOB NOT NULL,
+                    size INTEGER NOT NULL,
+                    stored REAL NOT NULL,
+                    accessed REAL NOT NULL,
+                    PRIMARY KEY (key, format)
+                )
+            ''')
+            db.execute('CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)')
+            # Total size of the entries, kept up to date by the triggers, so it isn't calculated on every put
+            db.execute('CREATE TABLE IF NOT EXISTS meta (id INTEGER PRIMARY KEY CHECK (id = 0), size INTEGER NOT NULL)')
+            db.execute('INSERT OR IGNORE INTO meta (id, size) SELECT 0, COALESCE(SUM(size), 0) FROM entries')
+            db.execute('''
+                CREATE TRIGGER IF NOT EXISTS entries_insert AFTER INSERT ON entries
+                BEGIN UPDATE meta SET size = size + NEW.size; END
+            ''')
+            db.execute('''
+                CREATE TRIGGER IF NOT EXISTS entries_delete AFTER DELETE ON entries
+                BEGIN UPDATE meta SET size = size - OLD.size; END
+            ''')
+
+    # Sent to worker processes without the connections: each process (and thread) opens its own
+    # (Access times not written yet stay with this process)
+    def __getstate__(self):
+        return {**self.__dict__, 'local': None, 'accessed': None, 'accessed_lock': None}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state, local=threading.local(), accessed={}, accessed_lock=threading.Lock())
+
+    @property
+    def connection(self):
+        # sqlite3 connections can't be shared between threads
+        if not hasattr(self.local, 'connection'):
+            connection = sqlite3.connect(self.path, timeout=30)
+            # Write-ahead log allows readers to work simultaneously with a writer
+            connection.execute('PRAGMA journal_mode=WAL')
+            # Otherwise INSERT OR REPLACE wouldn't fire the delete trigger for the replaced entry
+            connection.execute('PRAGMA recursive_triggers=ON')
+            self.local.connection = connection
+        return self.local.connection
+
+    def get(self, key, *, format, binary=False):
+        row = self.connection.execute(
+            'SELECT codec, data FROM entries WHERE key = ? AND format = ?', (key, format)
+        ).fetchone()
+        if not row:
+            return None
+
+        codec, data = row
+        with self.accessed_lock:
+            self.accessed[(key, format)] = time.time()
+            flush = len(self.accessed) >= self.ACCESS_BATCH
+        if flush:
+            with self.connection as db:
+                self._write_accessed(db)
+        data = self._codec(codec).decompress(data)
+        return data if binary else data.decode('utf-8')
+
+    def put(self, key, data, *, format, revision=None, etag=None):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        data = self._codec(self.compression).compress(data)
+        now = time.time()
+        with self.connection as db:
+            self._write_accessed(db)
+            db.execute(
+                'INSERT OR REPLACE INTO entries (key, format, revision, etag, codec, data, size, stored, accessed) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (key, format, revision, etag, self.compression, data, len(data), now, now)
+            )
+        if self.max_size is not None and self.size > self.max_size:
+            self.evict()
+
+    def info(self, key, *, format):
+        row = self.connection.execute(
+            'SELECT revision, etag, stored FROM entries WHERE key = ? AND format = ?', (key, format)
+        ).fetchone()
+        if row:
+            return dict(zip(('revision', 'etag', 'stored'), row))
+
+    def touch(self, key, *, format, revision=None):
+        with self.connection as db:
+            db.execute(
+                'UPDATE entries SET stored = ?, revision = COALESCE(?, revision) WHERE key = ? AND format = ?',
+                (time.time(), revision, key, format)
+            )
+
+    @property
+    def size(self):
+        return self.connection.execute('SELECT size FROM meta').fetchone()[0]
+
+    def evict(self):
+        with self.connection as db:
+            self._write_accessed(db)
+            excess = self.size - self.max_size
+            stale = []
+            for rowid, size in db.execute('SELECT rowid, size FROM entries ORDER BY accessed'):
+                if excess <= 0:
+                    break
+                stale.append((rowid,))
+                excess -= size
+            db.executemany('DELETE FROM entries WHERE rowid = ?', stale)
+
+    def _write_accessed(self, db):
+        with self.accessed_lock:
+            accessed, self.accessed = self.accessed, {}
+        db.executemany(
+            'UPDATE entries SET accessed = ? WHERE key = ? AND format = ?',
+            [(accessed_at, key, format) for (key, format), accessed_at in accessed.items()]
+        )
+
+    def _codec(self, name):
+        return importlib.import_module(CODECS[name])
+
+
+class MemoryCache:
+    """
+    LRU cache of parsed pages inside the process. Limited by number of entries and total ``size`` of
+    them (``None`` for no limit), as reported by ``put``: Wikipedia passes the estimated memory the
+    parsed page takes (see ``Wikipedia.PARSED_SIZE_RATIO``). Thread-safe.
+    """
+    def __init__(self, *, max_entries=32, max_size=128 * 2**20):
+        self.max_entries = max_entries
+        self.max_size = max_size
+        self.entries = OrderedDict() # key => (value, size)
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        with self.lock:
+            if key not in self.entries:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return self.entries[key][0]
+
+    def put(self, key, value, *, size=0):
+        with self.lock:
+            if key in self.entries:
+                self.size -= self.entries.pop(key)[1]
+            self.entries[key] = (value, size)
+            self.size += size
+
+            while self.entries and (len(self.entries) > self.max_entries or \
+                                    self.max_size is not None and self.size > self.max_size):
+                _, (_, evicted_size) = self.entries.popitem(last=False)
+                self.size -= evicted_size
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+# Module names; both have compress()/decompress() functions. zstandard is an optional dependency.
+CODECS = {
+    'zlib': 'zlib',
+    'zstd': 'zstandard',
+}
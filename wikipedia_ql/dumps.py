@@ -0,0 +1,111 @@
+from concurrent.futures import ProcessPoolExecutor
+import json
+import logging
+import os
+from pathlib import Path
+import tarfile
+
+from wikipedia_ql import fragment, media_wiki
+
+logger = logging.getLogger(__name__)
+
+class Dump:
+    """
+    Offline source of pages: `Wikimedia Enterprise HTML dump <https://dumps.wikimedia.org/other/enterprise_html/>`_
+    (``.tar.gz`` of ``.ndjson`` files with one article per line), or a single ``.ndjson`` file of the same
+    format. Everything is read in a streaming manner, so dumps of any size can be processed.
+    """
+    def __init__(self, path):
+        self.path = Path(path)
+
+    def records(self):
+        yield from (json.loads(line) for line in self.lines())
+
+    def pages(self, *, media_wiki=None, html_parser='html.parser'):
+        yield from (
+            page_from_record(record, media_wiki=media_wiki, html_parser=html_parser)
+            for record in self.records()
+        )
+
+    def query(self, query_text, *, processes=None, chunksize=8, html_parser='html.parser', segmenter='punkt'):
+        """
+        Runs the selectors (query without ``from`` part, like ``Wikipedia.query(..., page=...)`` accepts)
+        on each article of the dump, in a pool of ``processes`` (by default, as many as there are CPUs),
+        sending them ``chunksize`` articles at once. Yields ``(metadata, result)`` in the dump's order.
+        Articles that can't be read or queried are skipped, with a warning logged.
+        """
+        processes = processes or os.cpu_count()
+        # Numbered, to be able to tell which line it was if it can't be parsed
+        chunks = media_wiki.chunked(enumerate(self.lines(), 1), chunksize)
+
+        if processes <= 1:
+            _init_worker(query_text, html_parser, segmenter)
+            results = map(_query_chunk, chunks)
+        else:
+            results = media_wiki.bounded_map(
+                _query_chunk, chunks,
+                workers=processes, executor=ProcessPoolExecutor,
+                initializer=_init_worker, initargs=(query_text, html_parser, segmenter)
+            )
+
+        for chunk in results:
+            for number, metadata, result, error in chunk:
+                if error:
+                    title = metadata['title'] if metadata else '?'
+                    logger.warning('Skipping record #%d (%s) of %s: %s', number, title, self.path, error)
+                    continue
+                yield metadata, result
+
+    def lines(self):
+        if self.path.suffix == '.ndjson':
+            with self.path.open('rb') as file:
+                yield from filter(None, (line.strip() for line in file))
+            return
+
+        # Streaming mode: the archive is read sequentially, without seeking
+        with tarfile.open(self.path, mode='r|*') as tar:
+            for member in tar:
+                if member.isfile() and member.name.endswith('.ndjson'):
+                    yield from filter(None, (line.strip() for line in tar.extractfile(member)))
+
+
+def metadata_from_record(record):
+    # Making it look like the MediaWiki API's page info
+    return {
+        'pageid': record.get('identifier'),
+        'ns': record.get('namespace', {}).get('identifier', 0),
+        'title': record['name'],
+        'lastrevid': record.get('version', {}).get('identifier'),
+        'touched': record.get('date_modified'),
+        'url': record.get('url'),
+    }
+
+def page_from_record(record, *, media_wiki=None, html_parser='html.parser'):
+    return fragment.Fragment.parse(
+        record['article_body']['html'],
+        metadata=metadata_from_record(record), media_wiki=media_wiki, html_parser=html_parser
+    )
+
+# Worker process state: set up once by the pool initializer
+_worker = {}
+
+def _init_worker(query_text, html_parser, segmenter):
+    # Wikipedia object is only used for the services like URI conversion, nothing is fetched
+    wikipedia = media_wiki.Wikipedia(workers=1, memory_cache=False, html_parser=html_parser, segmenter=segmenter)
+    _worker['wikipedia'] = wikipedia
+    _worker['selector'] = wikipedia.parser.parse_selector(query_text).compile()
+
+def _query_chunk(lines):
+    # One broken article shouldn't stop the whole dump: errors are sent back with the results
+    wikipedia = _worker['wikipedia']
+    results = []
+    for number, line in lines:
+        metadata = None
+        try:
+            record = json.loads(line)
+            metadata = metadata_from_record(record)
+            page = page_from_record(record, media_wiki=wikipedia, html_parser=wikipedia.html_parser)
+            results.append((number, metadata, page.query(_worker['selector']), None))
+        except Exception as error:
+            results.append((number, metadata, None, f'{type(error).__name__}: {error}'))
+    return results
@@ -1,15 +1,21 @@
+from bisect import bisect_left
 import copy
+import itertools
 import re
 from collections import Counter
 import json
 
 import bs4
 from bs4 import BeautifulSoup
-import nltk
-import nltk.data
+import soupsieve
 
 import wikipedia_ql
+from wikipedia_ql import optimizer, serialize
+from wikipedia_ql.sections import SectionIndex
 from wikipedia_ql.selectors import follow_link
+from wikipedia_ql.sentences import SentenceIndex, get_segmenter
+from wikipedia_ql.tag_index import TagIndex, parse_simple
+from wikipedia_ql.text_tree import TextTree
 
 class Fragment:
     REMOVE = [
@@ -25,118 +31,293 @@ class Fragment:
         return cls.parse(data['parse']['text']['*'])
 
     @classmethod
-    def parse(cls, html, *, metadata=None, media_wiki=None):
-        soup = BeautifulSoup(html, 'html.parser').select_one('.mw-parser-output')
-        for tag in soup.select(','.join(cls.REMOVE)):
-            tag.decompose()
+    def parse(cls, html, *, metadata=None, media_wiki=None, html_parser='html.parser'):
+        # html_parser is BeautifulSoup's tree builder name: "html.parser", or "lxml" (faster, with the same
+        # results, but requires lxml to be installed); see benchmarks/parsers.py
+        soup = BeautifulSoup(html, html_parser).select_one('.mw-parser-output')
+        if soup is None:
+            raise ValueError('Page HTML has no .mw-parser-output element')
+        # Removing the unnecessary tags and building the text happens in one pass through the page
+        text_tree = TextTree.build(soup, remove=tag_matcher(cls.REMOVE))
 
-        return cls(soup, metadata=metadata, type='page', media_wiki=media_wiki)
+        return cls(soup, text_tree=text_tree, metadata=metadata, type='page', media_wiki=media_wiki)
 
-    def __init__(self, soup, text=None, text_tree=None, *, context=None, parent=None, metadata=None, type=None, media_wiki=None):
+    @classmethod
+    def load(cls, data, *, source_hash=None, metadata=None, media_wiki=None):
+        """
+        Loads the page dumped with ``dump``; returns ``None`` if the data is outdated (or doesn't
+        correspond to the ``source_hash``).
+        """
+        loaded = serialize.load(data, source_hash=source_hash)
+        if loaded:
+            soup, text_tree = loaded
+            return cls(soup, text_tree=text_tree, metadata=metadata, type='page', media_wiki=media_wiki)
+
+    def dump(self, *, source_hash=None):
+        return serialize.dump(self.soup, self.text_tree, source_hash=source_hash)
+
+    # Fragments don't copy the DOM: each is a view of the document's (page's) tree, with its text being
+    # [start, end) range of document's text, and the HTML it corresponds to described by kind and top node:
+    # * "node": top node itself;
+    # * "clip": the part of top node which is inside the range;
+    # * "span": several children of the top node, inside the range (like part of the paragraph);
+    # * "tags": siblings from top to last node.
+    # The standalone DOM (soup) is only built when requested, see make_soup.
+    __slots__ = (
+        'context', 'parent', 'metadata', 'type', 'media_wiki',
+        'kind', 'top', 'last', 'start', 'end', '_text_tree', '_soup', '_text', '_sentences'
+    )
+
+    def __init__(self, soup, text_tree=None, *, context=None, parent=None, metadata=None, type=None, media_wiki=None):
         self.context = context or {}
-        self.soup = soup
         self.parent = parent
         self.metadata = metadata
         self.type = type
         self.media_wiki = parent.media_wiki if parent else media_wiki
 
-        if text is None:
-            self._text = None
-            self._text_tree = None
-        else:
-            self._text = text
-            self._text_tree = text_tree
+        # The document is the soup itself; text tree is built lazily
+        self.kind = 'node'
+        self.top = 0
+        self.last = None
+        self._soup = soup
+        self._text = None
+        self._text_tree = text_tree
+        if text_tree is not None:
+            self.start, self.end = text_tree.span(0)
 
         self._sentences = None
 
+    def _view(self, kind, top, start, end, *, last=None, context=None):
+        fragment = Fragment.__new__(Fragment)
+        fragment.context = context or {}
+        fragment.parent = self
+        fragment.metadata = None
+        fragment.type = None
+        fragment.media_wiki = self.media_wiki
+        fragment.kind = kind
+        fragment.top = top
+        fragment.last = last
+        fragment.start = start
+        fragment.end = end
+        fragment._text_tree = self.text_tree
+        fragment._soup = None
+        fragment._text = None
+        fragment._sentences = None
+        return fragment
+
+    @property
+    def text_tree(self):
+        if self._text_tree is None:
+            self._text_tree = TextTree.build(self._soup)
+            self.start, self.end = self._text_tree.span(0)
+        return self._text_tree
+
     @property
     def text(self):
-        if self._text == None:
-            self._build_tree()
+        if self._text is None:
+            self._text = self.text_tree.text[self.start:self.end]
         return self._text
 
     @property
-    def text_tree(self):
-        if self._text == None:
-            self._build_tree()
-        return self._text_tree
+    def soup(self):
+        if self._soup is None:
+            self._soup = self.make_soup()
+        return self._soup
+
+    @property
+    def node(self):
+        """
+        The node the fragment's HTML has at top, without copying anything: the document's node or, for
+        the fragments of several nodes, an empty wrapper tag.
+        """
+        if self.kind == 'node' or self.kind == 'clip':
+            return self.text_tree.nodes[self.top]
+        return WRAPPERS[self.kind]
 
     @property
     def sentences(self):
         if self._sentences == None:
-            sent_detector = nltk.data.load('tokenizers/punkt/english.pickle')
-            self._sentences = []
-            start = 0
-            for line in self.text.split("\n"):
-                for s, e in sent_detector.span_tokenize(line):
-                    self._sentences.append((line[s:e], start + s, start +e))
-                start += len(line) + 1 # \n
-
+            self._sentences = [*self.iter_sentences()]
         return self._sentences
 
+    def iter_sentences(self, *, line_filter=None):
+        """
+        Yields ``(text, start, end)`` of the fragment's sentences, with offsets in the fragment's text.
+        Sentences are found once per page (and only as far as they are asked for); ``line_filter`` allows
+        to skip the lines of text which can't have sentences needed.
+        """
+        tree = self.text_tree
+        segmenter = get_segmenter(self.media_wiki.segmenter if self.media_wiki else 'punkt')
+        index = tree.indexes.get(('sentences', segmenter))
+        if index is None:
+            index = tree.indexes[('sentences', segmenter)] = SentenceIndex(tree.text, segmenter)
+
+        for start, end in index.sentences(self.start, self.end, line_filter=line_filter):
+            yield (tree.text[start:end], start - self.start, end - self.start)
+
+    def sections(self, *, heading=None, level=None):
+        """
+        Nodes of the sections inside the fragment (see ``SectionIndex.find``), in document order. Sections
+        are indexed once per page.
+        """
+        tree = self.text_tree
+        index = tree.indexes.get('sections')
+        if index is None:
+            index = tree.indexes['sections'] = SectionIndex(tree)
+        return self.nodes_inside(index.find(heading=heading, level=level))
+
     @property
     def page(self):
         return self if self.parent is None else self.parent.page
 
     def slice(self, start, end, *, context=None):
-        def make_slice(node, text_tree):
-            s, e, children = text_tree
-            if e < start or s > end:
-                return None
-
-            if s >= start and e <= end:
-                return (copy.copy(node), text_tree)
-
-            s1 = start - s if s < start else 0
-            e1 = end - e if e > end else None
-
-            new_s = s + s1
-            new_e = e + e1 + 1 if e1 else e
-
-            if new_e and new_e <= new_s + 1: # empty
-                return None
-
-            if isinstance(node, bs4.element.NavigableString):
-                text = str(node)[s1:e1]
-                return (bs4.element.NavigableString(text), (new_s, new_e, []))
-
-            sliced_children = list(filter(
-                None,
-                [make_slice(child, tchild) for child, tchild in zip(node.children, children)]
-            ))
-            node_children = [n for n, t in sliced_children]
-            tree_children = [t for n, t in sliced_children]
-
-            if s > start or e < end:
-                new_node = copy.copy(node)
-                new_node.clear()
-                new_node.extend(node_children)
-            elif len(node_children) == 1:
-                new_node = node_children[0]
-                tree_children = tree_children[0][2]
+        tree = self.text_tree
+        start = self.start + start
+        end = min(self.start + end, self.end)
+
+        if (start, end) == (self.start, self.end):
+            return self._view(self.kind, self.top, start, end, last=self.last, context=context)
+
+        # Only nodes inside the range are visited, found by the text tree offsets
+        idx = tree.parents[self.top] if self.kind == 'tags' else self.top
+        while True:
+            s, e = tree.starts[idx], tree.ends[idx]
+            if start <= s and e <= end:
+                kind = 'node'
+            elif s > start or e < end or isinstance(tree.nodes[idx], bs4.element.NavigableString):
+                kind = 'clip'
             else:
-                new_node = BeautifulSoup('', 'html.parser').new_tag('span')
-                new_node.extend(node_children)
-
-            return (new_node, (new_s, new_e, tree_children))
-
-        tstart, tend = start, end
-        start += self.text_tree[0]
-        end += self.text_tree[0]
-
-        res_node, res_tree = make_slice(self.soup, self.text_tree)
-
-        return Fragment(res_node, self.text[tstart:tend], res_tree, context=context, parent=self)
+                children = [*itertools.islice(tree.children_within(idx, start, end), 2)]
+                if len(children) == 1:
+                    idx = children[0]
+                    continue
+                kind = 'span'
+            return self._view(kind, idx, start, end, context=context)
 
     def slice_tags(self, tags):
-        if len(tags) == 1:
-            return Fragment(tags[0], parent=self)
-        else:
+        tree = self.text_tree
+        indexes = [tree.index(tag) for tag in tags]
+        if None in indexes:
+            # Not the document's nodes
+            if len(tags) == 1:
+                return Fragment(tags[0], parent=self)
             new_node = BeautifulSoup('', 'html.parser').new_tag('div')
             new_node.extend([copy.copy(tag) for tag in tags])
             return Fragment(new_node, parent=self)
 
+        if len(indexes) == 1:
+            return self.node_fragment(indexes[0])
+        return self._view('tags', indexes[0], tree.starts[indexes[0]], tree.ends[indexes[-1]], last=indexes[-1])
+
+    def node_fragment(self, idx):
+        """
+        Fragment of the node ``idx`` of the document, or of its part inside this fragment.
+        """
+        tree = self.text_tree
+        start, end = max(tree.starts[idx], self.start), min(tree.ends[idx], self.end)
+        kind = 'node' if tree.span(idx) == (start, end) else 'clip'
+        return self._view(kind, idx, start, end)
+
+    def children_fragment(self, idx):
+        """
+        Fragment of all the children of the node ``idx`` of the document (inside this fragment).
+        """
+        tree = self.text_tree
+        children = [*tree.children_within(idx, self.start, self.end)]
+        if not children:
+            return self._view('span', idx, tree.starts[idx], tree.starts[idx])
+        start, end = max(tree.starts[children[0]], self.start), min(tree.ends[children[-1]], self.end)
+        return self._view('tags', children[0], start, end, last=children[-1])
+
+    def matches(self, css_selector):
+        """
+        Whether the top node of the fragment matches the CSS selector (string, or compiled by soupsieve).
+        """
+        node = self.node
+        if not isinstance(node, bs4.element.Tag):
+            return False
+        simple = parse_simple(css_pattern(css_selector))
+        if simple is not None:
+            return any(selector.match(node) for selector in simple)
+        return soupsieve.compile(css_selector).match(node)
+
+    def select_nodes(self, css_selector):
+        """
+        Indexes of the document's nodes inside the fragment matching the CSS selector, in document order.
+        Simple selectors (by tag name, class and id) are looked up in the page's ``TagIndex``.
+        """
+        tree = self.text_tree
+        simple = parse_simple(css_pattern(css_selector))
+        if simple is not None:
+            index = tree.indexes.get('tags')
+            if index is None:
+                index = tree.indexes['tags'] = TagIndex(tree)
+            return self.nodes_inside(index.find(simple))
+
+        selector = soupsieve.compile(css_selector)
+
+        if self.kind == 'node' or self.kind == 'tags' and self.start == tree.starts[self.top] and self.end == tree.ends[self.last]:
+            # Whole nodes: soupsieve walks through them much faster than matches them one by one
+            tops = [self.top] if self.kind == 'node' else [*tree.siblings(self.top, self.last)]
+            found = []
+            for top in tops:
+                node = tree.nodes[top]
+                if not isinstance(node, bs4.element.Tag):
+                    continue
+                if self.kind == 'tags' and selector.match(node):
+                    found.append(top)
+                found.extend(tree.index(child) for child in selector.select(node))
+            return found
+
+        # Part of the node: checking only what's inside the range
+        if self.kind == 'tags':
+            lo, hi = self.top, tree.subtree_end(self.last)
+        else:
+            lo, hi = self.top + 1, tree.subtree_end(self.top)
+        nodes = tree.nodes
+        return [
+            idx for idx in tree.nodes_within(lo, hi, self.start, self.end)
+            if isinstance(nodes[idx], bs4.element.Tag) and selector.match(nodes[idx])
+        ]
+
+    def nodes_inside(self, nodes):
+        """
+        Those of the document's nodes (sorted list of indexes) which are inside the fragment: the same
+        ones ``select_nodes`` would find.
+        """
+        tree = self.text_tree
+        if self.kind == 'tags':
+            lo, hi = self.top, tree.subtree_end(self.last)
+        else:
+            lo, hi = self.top + 1, tree.subtree_end(self.top)
+        start, end = self.start, self.end
+        return [
+            idx for idx in nodes[bisect_left(nodes, lo):bisect_left(nodes, hi)]
+            if tree.includes(idx, start, end)
+        ]
+
+    def make_soup(self):
+        """
+        Standalone DOM of the fragment: the document's node itself if the fragment is the whole node,
+        or a partial copy of it.
+        """
+        tree = self.text_tree
+        start, end = self.start, self.end
+        if self.kind == 'node':
+            return tree.nodes[self.top]
+        if self.kind == 'clip':
+            return copy_slice(tree, self.top, start, end, clip=True)
+
+        if self.kind == 'span':
+            children = tree.children_within(self.top, start, end)
+        else:
+            children = [idx for idx in tree.siblings(self.top, self.last) if tree.includes(idx, start, end)]
+        new_node = BeautifulSoup('', 'html.parser').new_tag('span' if self.kind == 'span' else 'div')
+        new_node.extend([copy_slice(tree, idx, start, end) for idx in children])
+        return new_node
+
     def select(self, selector):
+        selector = selector.compile()
         fragments = Fragments(self._select(selector))
         if selector.nested:
             return fragments.select(selector.nested)
@@ -146,11 +327,22 @@ class Fragment:
     def _select(self, selector):
         return [*selector(self)]
 
+    def _iselect(self, selector):
+        return selector(self)
+
     def query(self, selector):
         if isinstance(selector, str):
             selector = self.media_wiki.parser.parse_selector(selector)
         return query(self, selector)
 
+    def iquery(self, selector):
+        """
+        Like ``query``, but yields the results one by one, as they are found (see ``iquery`` function).
+        """
+        if isinstance(selector, str):
+            selector = self.media_wiki.parser.parse_selector(selector)
+        return iquery(self, selector)
+
     def attribute(self, name):
         # TODO:
         # * available attr depends on fragment's type
@@ -158,37 +350,18 @@ class Fragment:
         if self.type == 'page':
             return self.metadata.get(name)
         else:
-            value = self.soup.get(name)
+            value = self.node.get(name)
             if value and (name == 'href' or name == 'src') and self.media_wiki:
                 value = self.media_wiki.absoluteize_uri(value)
             return value
 
-    def _build_tree(self):
-        def build_subtree(node):
-            start = len(self._text)
-            if isinstance(node, bs4.element.NavigableString):
-                self._text += str(node).replace('\xa0', ' ')
-                children = []
-            else:
-                children = [build_subtree(child) for child in node.children]
-                if node.name in ['p', 'div', 'ul', 'ol', 'li', 'table', 'tbody', 'tr', 'br', 'h2', 'h3', 'h4', 'h5']:
-                    self._text += "\n"
-                else:
-                    pass
-
-            end = len(self._text)
-
-            return (start, end, children)
-
-        self._text = ''
-        self._text_tree = build_subtree(self.soup) # will update _text, too
-
 
 class Fragments:
     def __init__(self, items):
         self.items = items
 
     def select(self, selector):
+        selector = selector.compile()
         fragments = Fragments([nested for item in self.items for nested in item._select(selector)])
 
         if selector.nested:
@@ -200,28 +373,176 @@ class Fragments:
         return query(self, selector)
 
     def _select(self, selector):
-        return [nested for item in self.items for nested in item._select(selector)]
+        return [*self._iselect(selector)]
+
+    def _iselect(self, selector):
+        return (nested for item in self.items for nested in item._iselect(selector))
 
     def __iter__(self):
         return self.items.__iter__()
 
+# Empty tags standing for the top of the fragments of several nodes
+WRAPPERS = {'span': BeautifulSoup('', 'html.parser').new_tag('span'), 'tags': BeautifulSoup('', 'html.parser').new_tag('div')}
+
+def copy_slice(tree, idx, start, end, *, clip=False):
+    """
+    Copy of the node ``idx`` of the text tree, with only the part inside the ``[start, end)`` range. If
+    the node goes beyond the range on both sides, it is replaced with its only child inside the range, or
+    the ``span`` with several of them (unless ``clip`` is true).
+    """
+    node = tree.nodes[idx]
+    s, e = tree.starts[idx], tree.ends[idx]
+    if start <= s and e <= end:
+        return copy.copy(node)
+
+    if isinstance(node, bs4.element.NavigableString):
+        return bs4.element.NavigableString(str(node)[max(s, start) - s:min(e, end) - s])
+
+    children = [copy_slice(tree, child, start, end) for child in tree.children_within(idx, start, end)]
+    if clip or s > start or e < end:
+        new_node = shallow_copy(node)
+    elif len(children) == 1:
+        return children[0]
+    else:
+        new_node = BeautifulSoup('', 'html.parser').new_tag('span')
+    new_node.extend(children)
+    return new_node
+
+def shallow_copy(tag):
+    # Tag.copy_self() (copy without children) was added in bs4 4.13
+    if hasattr(tag, 'copy_self'):
+        return tag.copy_self()
+    new_tag = copy.copy(tag)
+    new_tag.clear()
+    return new_tag
+
+def css_pattern(css_selector):
+    # Source of the selector, if it is compiled by soupsieve
+    return css_selector if isinstance(css_selector, str) else css_selector.pattern
+
+def tag_matcher(selectors):
+    """
+    Turns the list of CSS selectors into ``tag => bool`` function. Simple ones (``tag``, ``.class``, ``tag.class``)
+    are checked by name and class directly, which is much faster than matching them with soupsieve
+    on every tag; anything more complicated falls back to it.
+    """
+    names = {}  # name or None => set of classes, or None for "any"
+    complex = []
+    for selector in selectors:
+        match = re.fullmatch(r'([a-z][a-z0-9-]*)?(?:\.([\w-]+))?', selector.strip())
+        if match and any(match.groups()):
+            name, klass = match.groups()
+            if klass is None:
+                names[name] = None
+            elif names.get(name, set()) is not None:
+                names.setdefault(name, set()).add(klass)
+        else:
+            complex.append(selector)
+
+    compiled = soupsieve.compile(','.join(complex)) if complex else None
+
+    def matches(tag):
+        for name in (tag.name, None):
+            if name in names:
+                classes = names[name]
+                if classes is None or not classes.isdisjoint(tag.get('class') or ()):
+                    return True
+        return compiled is not None and compiled.match(tag)
+
+    return matches
+
 # FIXME: Base class queriable?..
 def query(subject, selector):
+    # Does nothing if it is already compiled, which is the case for the nested ones
+    selector = selector.compile()
     if isinstance(selector, wikipedia_ql.selectors.alt):
-        return flatten_and_merge([subject.query(sel) for sel in selector.selectors])
-
-    fragments = Fragments(subject._select(selector))
+        return flatten_and_merge(query_branches(subject, selector.selectors, selector.branches))
+    return [*iquery(subject, selector)]
+
+def iquery(subject, selector):
+    """
+    Streaming version of ``query``: yields the items of its result as soon as they are found, so the
+    consumer can stop early, and they don't need to be kept in memory all at once. When the results
+    of ``{ ... }`` group are merged into one dict, it is yielded as one item (after all of the group's
+    results are found, as until then it isn't known whether they are mergeable).
+    """
+    selector = selector.compile()
+    if isinstance(selector, wikipedia_ql.selectors.alt):
+        yield from merge_stream(branches_items(subject, selector))
+        return
 
-    if selector.name:
-        if selector.nested:
-            return [{selector.name: fragment.query(selector.nested)} for fragment in fragments.items]
+    for fragment in subject._iselect(selector):
+        if selector.name:
+            if selector.nested:
+                yield {selector.name: fragment.query(selector.nested)}
+            else:
+                yield {selector.name: query_value(fragment, selector)}
         else:
-            return [{selector.name: query_value(fragment, selector)} for fragment in fragments.items]
+            if selector.nested:
+                yield from iquery(fragment, selector.nested)
+            else:
+                yield query_value(fragment, selector)
+
+def branches_items(subject, selector):
+    # Results of all the alt group's branches, one by one. Branches sharing steps run together (see
+    # query_branches), others are streamed.
+    if any(isinstance(unit, optimizer.Shared) for unit in selector.branches):
+        for result in query_branches(subject, selector.selectors, selector.branches):
+            yield from flatten([result])
     else:
-        if selector.nested:
-            return flatten([fragment.query(selector.nested) for fragment in fragments.items])
-        else:
-            return [query_value(fragment, selector) for fragment in fragments.items]
+        for branch in selector.selectors:
+            yield from iquery(subject, branch)
+
+def merge_stream(items):
+    # Same as flatten_and_merge for the stream of (already flat) items: they are passed through as soon as
+    # it is clear they aren't mergeable
+    buffered = []
+    keys = set()
+    for item in items:
+        if buffered is not None:
+            if isinstance(item, dict) and keys.isdisjoint(item):
+                buffered.append(item)
+                keys.update(item)
+                continue
+            yield from buffered
+            buffered = None
+        yield item
+
+    if buffered is not None:
+        yield merge(*buffered)
+
+def query_branches(subject, selectors, branches):
+    """
+    Results of ``query(subject, selector)`` for each of the selectors, run according to the
+    ``optimizer.plan``: the steps several selectors start with are run once.
+    """
+    results = [None] * len(selectors)
+    for unit in branches:
+        if not isinstance(unit, optimizer.Shared):
+            results[unit] = query(subject, selectors[unit])
+            continue
+
+        fragments = subject._select(unit.step)
+        members = [selectors[idx] for idx in unit.members]
+        nested = [member.nested for member in members if member.nested]
+        nested_results = [query_branches(fragment, nested, unit.nested) for fragment in fragments] if nested else []
+
+        # Same as query() makes of each selector's fragments
+        nested_idx = 0
+        for idx, member in zip(unit.members, members):
+            if member.nested:
+                values = [fragment_results[nested_idx] for fragment_results in nested_results]
+                nested_idx += 1
+            else:
+                values = [query_value(fragment, member) for fragment in fragments]
+
+            if member.name:
+                results[idx] = [{member.name: value} for value in values]
+            elif member.nested:
+                results[idx] = flatten(values)
+            else:
+                results[idx] = values
+    return results
 
 def query_value(fragment, selector):
     return fragment.text.strip()
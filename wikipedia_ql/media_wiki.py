@@ -1,15 +1,18 @@
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, FIRST_COMPLETED, wait
+import functools
+import hashlib
+import itertools
 import json
-from pathlib import Path
-import re
+import multiprocessing
+import threading
+import time
 import urllib.parse
 
-import requests
-
-from lark import Lark
-import lark
-
 from wikipedia_ql import fragment
+from wikipedia_ql.cache import FolderCache, MemoryCache
 from wikipedia_ql.parser import Parser
+from wikipedia_ql.scheduler import Scheduler
 
 # TODO: Include version: wikipedia_ql/{version}
 DEFAULT_UA = 'wikipedia_ql (https://github.com/zverok/wikipedia_ql; zverok.offline@gmail.com)'
@@ -27,102 +30,400 @@ class Wikipedia:
     QUERY_PARAMS = {
         'action': 'query',
         'format': 'json',
-        'redirects': 1
+        'redirects': 1,
+        'prop': 'info' # Includes lastrevid into metadata
     }
+    # Max number of titles MediaWiki API allows to pass in one query
+    METADATA_BATCH_SIZE = 50
+    NS_MAIN = 0
+    NS_CATEGORY = 14
+
+    # Parsed page (its tree, text, and indexes) takes 5-12 times more memory than its HTML; that's how
+    # its size is estimated for the memory cache
+    PARSED_SIZE_RATIO = 10
 
-    def __init__(self, cache_folder=None, user_agent=DEFAULT_UA):
+    # Responses on which the request is retried (with exponential backoff); 429 is handled by scheduler
+    RETRY_STATUSES = (500, 502, 503, 504)
+
+    def __init__(self, cache_folder=None, user_agent=DEFAULT_UA, workers=4, *,
+                 cache=None, cache_parsed=True, memory_cache=True, revalidate='never',
+                 retries=3, backoff_factor=0.5, session=None, maxlag=5, scheduler=None,
+                 html_parser='html.parser', segmenter='punkt', processes=None, chunksize=4):
         self.parser = Parser()
-        if cache_folder:
-            self.cache_folder = Path(cache_folder)
-            self.cache_folder.mkdir(exist_ok=True, parents=True)
-        else:
-            self.cache_folder = None
+        # See Fragment.parse
+        self.html_parser = html_parser
+        # How sentences are found: "punkt" (NLTK), "regex" (faster, and doesn't need NLTK data), or
+        # custom object; see wikipedia_ql.sentences
+        self.segmenter = segmenter
+        # cache_folder is a shortcut for the default cache backend; see wikipedia_ql.cache for others
+        if cache is None and cache_folder:
+            cache = FolderCache(cache_folder)
+        self.cache = cache
+        # Store pre-parsed pages in cache, too, to not parse HTML again
+        self.cache_parsed = cache_parsed
+        # Parsed pages kept in memory, by (title, revision); False to disable
+        self.memory_cache = MemoryCache() if memory_cache is True else memory_cache or None
+        # When cached pages are checked for being up-to-date: 'never', 'always', or number of seconds
+        # since they were fetched/last checked
+        self.revalidate = revalidate
 
         self.user_agent = user_agent
+        # How many pages are fetched simultaneously by get_category/get_pages; 1 means sequential fetching
+        self.workers = workers
+        # Session is made on the first request, so querying the cached pages doesn't import requests
+        self._session = session
+        self._session_lock = threading.Lock()
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        # See https://www.mediawiki.org/wiki/Manual:Maxlag_parameter
+        self.maxlag = maxlag
+        self.scheduler = scheduler or Scheduler(max_concurrency=workers)
+        # Parsing and querying the pages is CPU-bound, so for categories and page lists it can be done in
+        # a pool of processes (sending them ``chunksize`` pages at once); None or 1 means in this process.
+        # Processes are spawned, not forked, so scripts using it need ``if __name__ == '__main__':`` guard.
+        # The pages are fetched by this process, but workers fetch the linked pages for ``->`` themselves,
+        # each with its own scheduler allowed 1/processes of this one's rate: together, they can make
+        # requests at the same rate as this process does, on top of it. See _query_in_processes
+        self.processes = processes
+        self.chunksize = chunksize
 
-    def query(self, query_text, page=None):
+    @property
+    def session(self):
+        if self._session is None:
+            with self._session_lock:
+                if self._session is None:
+                    self._session = self._make_session(retries=self.retries, backoff_factor=self.backoff_factor)
+        return self._session
+
+    def query(self, query_text, page=None, *, category_depth=0):
         if page:
             type = 'page'
             selector = self.parser.parse_selector(query_text)
         else:
             type, page, selector = self.parser.parse(query_text)
+        # Prepared once for all the pages
+        selector = selector.compile()
 
         if type == 'page':
             return self.get_page(page).query(selector)
         elif type == 'category':
-            return [fragment.query(selector) for fragment in self.get_category(page)]
+            if self._use_processes():
+                return [*self._query_in_processes(self._category_metadata(page, category_depth), selector)]
+            return [fragment.query(selector) for fragment in self.get_category(page, depth=category_depth)]
 
-    def iquery(self, query_text):
+    def iquery(self, query_text, *, ordered=True, category_depth=0):
         type, page, selector = self.parser.parse(query_text)
+        selector = selector.compile()
         if type == 'page':
             yield self.get_page(page).query(selector)
         elif type == 'category':
-            yield from (fragment.query(selector) for fragment in self.get_category(page))
+            if self._use_processes():
+                yield from self._query_in_processes(
+                    self._category_metadata(page, category_depth), selector, ordered=ordered
+                )
+                return
+            yield from (
+                fragment.query(selector)
+                for fragment in self.get_category(page, depth=category_depth, ordered=ordered)
+            )
 
-    def get_page(self, title):
-        metadata = self.cache_get(title + '.props')
-        if not metadata:
-            response = self.__query_get(titles=title)
-            metadata = [*json.loads(response.content.decode('utf-8'))['query']['pages'].values()][0]
-            self.cache_put(title + '.props', json_data=metadata)
+    def stream(self, query_text, page=None, *, ordered=True, category_depth=0):
+        """
+        Like ``query``, but yields the result items one by one, as soon as they are found (see
+        ``Fragment.iquery``); for a category, items of all its pages, page by page. Pages are fetched and
+        processed as the results are consumed, so only a few of them are in memory at once, and stopping
+        early doesn't fetch the rest. With ``processes``, category pages are queried in worker processes,
+        and their items are yielded when the page's chunk is ready.
+        """
+        if page:
+            type = 'page'
+            selector = self.parser.parse_selector(query_text)
+        else:
+            type, page, selector = self.parser.parse(query_text)
+        selector = selector.compile()
+
+        if type == 'page':
+            yield from self.get_page(page).iquery(selector)
+        elif type == 'category':
+            if self._use_processes():
+                # Pages' results come from the workers as a whole; merged { ... } group is one item, as
+                # Fragment.iquery yields it
+                metadata = self._category_metadata(page, category_depth)
+                for result in self._query_in_processes(metadata, selector, ordered=ordered):
+                    yield from ([result] if isinstance(result, dict) else result)
+                return
+            for fragment in self.get_category(page, depth=category_depth, ordered=ordered):
+                yield from fragment.iquery(selector)
 
+    def iquery_pages(self, titles, query_text, *, ordered=True):
+        """
+        Runs the selectors (query without ``from`` part, like ``query(..., page=...)`` accepts) on each of
+        the pages, yielding their results in the order of ``titles`` (or as soon as they are ready, with
+        ``ordered=False``). Missing pages are skipped.
+        """
+        selector = self.parser.parse_selector(query_text).compile()
+        if self._use_processes():
+            metadata = self._check_revisions(self.get_metadata(titles))
+            yield from self._query_in_processes(metadata, selector, ordered=ordered)
+        else:
+            yield from (page.query(selector) for page in self.get_pages(titles, ordered=ordered))
+
+    def get_page(self, title):
         # TODO: save metadata to cache under the real title, too!
-        return self._parse_page(metadata)
-
-    def get_pages(self, titles):
-        # TODO: We can multi-fetch all pages metadata with one query; but before that we'll check if
-        # some of it is in the cache already
-        return filter(None, [self.get_page(title) for title in titles])
-
-    def get_category(self, category):
-        response = self.__query_get(
-            generator = 'categorymembers',
-            gcmtitle = f'Category:{category}',
-            gcmnamespace = 0,
-            gcmlimit = 100
+        metadata, = self._check_revisions(self.get_metadata([title]))
+        return self._parse_page(*self._fetch_html(metadata))
+
+    def get_pages(self, titles, *, ordered=True):
+        metadata = self._check_revisions(self.get_metadata(titles))
+        fetched = bounded_map(self._fetch_html, metadata, workers=self.workers, ordered=ordered)
+        return filter(None, (self._parse_page(metadata, html) for metadata, html in fetched))
+
+    def get_metadata(self, titles):
+        """
+        Lazily yields metadata for each of the ``titles``, in order. Metadata absent from the cache is
+        requested from the API in batches of ``METADATA_BATCH_SIZE`` titles.
+        """
+        titles = iter(titles)
+        while True:
+            batch = [*itertools.islice(titles, self.METADATA_BATCH_SIZE)]
+            if not batch:
+                return
+
+            metadata = {title: self.cache_get(title + '.props') for title in batch}
+            missing = [*dict.fromkeys(title for title, data in metadata.items() if not data)]
+            if missing:
+                fetched = self._query_metadata(missing)
+                for title in missing:
+                    self.cache_put(title + '.props', json_data=fetched[title])
+                metadata.update(fetched)
+
+            yield from (metadata[title] for title in batch)
+
+    def _query_metadata(self, titles):
+        response = self.__query_get(titles='|'.join(titles))
+        data = json.loads(response.content.decode('utf-8'))['query']
+
+        # The API reports how requested titles were normalized ("foo_bar" => "Foo bar") and then
+        # redirected; we follow the same chain to map the pages back to the titles requested.
+        normalized = {item['from']: item['to'] for item in data.get('normalized', [])}
+        redirects = {item['from']: item['to'] for item in data.get('redirects', [])}
+        pages = {page['title']: page for page in data['pages'].values()}
+
+        result = {}
+        for title in titles:
+            real_title = normalized.get(title, title)
+            real_title = redirects.get(real_title, real_title)
+            page = pages.get(real_title, {'title': title, 'missing': ''})
+            # Invalid titles are reported without "missing", but are no better for us
+            if 'invalid' in page:
+                page = {**page, 'missing': ''}
+            result[title] = page
+
+        return result
+
+    def get_category(self, category, *, depth=0, ordered=True):
+        metadata = self._category_metadata(category, depth)
+        fetched = bounded_map(self._fetch_html, metadata, workers=self.workers, ordered=ordered)
+        # Pages might be missing when they were deleted after the category (or cache) was listed
+        return filter(None, (self._parse_page(m, html) for m, html in fetched))
+
+    def _category_metadata(self, category, depth):
+        return self._check_revisions(self.get_category_members(category, depth=depth))
+
+    def get_category_members(self, category, *, depth=0):
+        """
+        Lazily yields metadata of the pages in the category. With ``depth`` > 0, subcategories are walked, too
+        (breadth-first, up to ``depth`` levels deep); each page is yielded only once, even if it belongs to
+        several of them.
+        """
+        visited = {category}
+        queue = deque([(category, 0)])
+        seen_pages = set()
+
+        while queue:
+            category, level = queue.popleft()
+            namespaces = f'{self.NS_MAIN}|{self.NS_CATEGORY}' if level < depth else self.NS_MAIN
+            for member in self.__category_listing(category, namespaces):
+                if member['ns'] == self.NS_CATEGORY:
+                    subcategory = member['title'].split(':', 1)[1]
+                    if subcategory not in visited:
+                        visited.add(subcategory)
+                        queue.append((subcategory, level + 1))
+                elif member['pageid'] not in seen_pages:
+                    seen_pages.add(member['pageid'])
+                    yield member
+
+    def __category_listing(self, category, namespaces):
+        continuation = {}
+        while True:
+            response = self.__query_get(
+                generator = 'categorymembers',
+                gcmtitle = f'Category:{category}',
+                gcmnamespace = namespaces,
+                gcmlimit = 'max',
+                **continuation
+            )
+            data = json.loads(response.content.decode('utf-8'))
+            # Empty category (or empty last page of it) has no "query" key at all
+            yield from data.get('query', {}).get('pages', {}).values()
+
+            if 'continue' not in data:
+                return
+            continuation = data['continue']
+
+    def _check_revisions(self, metadata):
+        """
+        For pages which cached HTML needs revalidation, replaces their metadata with a freshly fetched
+        one (in batches of ``METADATA_BATCH_SIZE``), so ``_fetch_html`` would know their current revision.
+        """
+        if not self.cache or self.revalidate == 'never':
+            yield from metadata
+            return
+
+        metadata = iter(metadata)
+        while True:
+            batch = [*itertools.islice(metadata, self.METADATA_BATCH_SIZE)]
+            if not batch:
+                return
+
+            stale = [
+                m['title'] for m in batch
+                if 'missing' not in m and self._is_stale(self.cache.info(m['title'], format='html'))
+            ]
+            fresh = self._query_metadata(stale) if stale else {}
+            yield from (fresh.get(m.get('title'), m) for m in batch)
+
+    def _is_stale(self, info):
+        if info is None or self.revalidate == 'never':
+            return False
+        if self.revalidate == 'always':
+            return True
+        return time.time() - info['stored'] > self.revalidate
+
+    # Network/cache part of the page fetching, safe to run in a worker thread; the parsing is performed
+    # by _parse_page in the caller's thread. Unless in_memory=False, HTML of the pages that are in the
+    # memory cache isn't read, as it wouldn't be needed.
+    def _fetch_html(self, metadata, *, in_memory=True):
+        if 'missing' in metadata or in_memory and self._memory_key(metadata) in (self.memory_cache or ()):
+            return (metadata, None)
+
+        real_title = metadata['title']
+
+        text_data = self.cache_get(real_title, format='html')
+        etag = None
+        if text_data:
+            info = self.cache.info(real_title, format='html')
+            if not self._is_stale(info):
+                return (metadata, text_data)
+            if info['revision'] is not None and info['revision'] == metadata.get('lastrevid'):
+                self.cache.touch(real_title, format='html')
+                return (metadata, text_data)
+            # Revision have changed or unknown: maybe the HTML is still the same, ask Parsoid
+            etag = info['etag']
+
+        response = self.__page_get(real_title, etag=etag)
+        if response.status_code == 304:
+            # The cached HTML is of the current revision: next time, it will be seen from the metadata
+            self.cache.touch(real_title, format='html', revision=metadata.get('lastrevid'))
+            return (metadata, text_data)
+
+        text_data = response.content.decode('utf-8')
+        self.cache_put(
+            real_title, text=text_data, format='html',
+            revision=metadata.get('lastrevid'), etag=response.headers.get('ETag')
         )
-        # TODO: Continue if there is more than 100 pages in category
-        # TODO: Distinguish nested category; go recursively by separate parameter
-        metadata = [*json.loads(response.content.decode('utf-8'))['query']['pages'].values()]
 
-        yield from (self._parse_page(m) for m in metadata)
+        return (metadata, text_data)
 
-    def _parse_page(self, metadata):
+    def _parse_page(self, metadata, html):
         if 'missing' in metadata:
             return None
 
+        if self.memory_cache is None:
+            return self._load_page(metadata, html)
+
+        key = self._memory_key(metadata)
+        page = self.memory_cache.get(key)
+        if page is None:
+            if html is None: # It was in memory cache when _fetch_html checked, but not anymore
+                metadata, html = self._fetch_html(metadata)
+            page = self._load_page(metadata, html)
+            self.memory_cache.put(key, page, size=len(html) * self.PARSED_SIZE_RATIO)
+        return page
+
+    def _use_processes(self):
+        return self.processes is not None and self.processes > 1
+
+    def _query_in_processes(self, metadata, selector, *, ordered=True):
+        """
+        Yields results of the compiled ``selector`` for each of the pages, in order, with the pages parsed
+        and queried in a pool of ``processes``. Pages are fetched (or read from the cache) here, in
+        threads, as usual; workers receive their HTML in chunks, and send back only the results. Worker
+        processes have their own ``Wikipedia`` objects with the same cache and settings (see
+        ``_worker_options``), which store the pre-parsed pages, and fetch the pages for ``->``.
+        """
+        fetch = functools.partial(self._fetch_html, in_memory=False)
+        fetched = bounded_map(fetch, metadata, workers=self.workers, ordered=ordered)
+        # Missing pages (see get_category) are skipped here, workers only receive the existing ones
+        chunks = chunked((page for page in fetched if 'missing' not in page[0]), self.chunksize)
+        results = bounded_map(
+            _query_chunk, chunks,
+            workers=self.processes, ordered=ordered, executor=ProcessPoolExecutor,
+            # Forking while the fetching threads are working could copy the locks (and SQLite connections)
+            # they hold into the worker, leaving them locked forever
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_worker,
+            initargs=(self._worker_options(), self.scheduler.share(self.processes), selector)
+        )
+        for chunk in results:
+            yield from chunk
+
+    def _worker_options(self):
+        # Session and scheduler can't be sent to another process, so workers make their own
+        return dict(
+            cache=self.cache, cache_parsed=self.cache_parsed, revalidate=self.revalidate,
+            user_agent=self.user_agent, workers=self.workers, retries=self.retries,
+            backoff_factor=self.backoff_factor, maxlag=self.maxlag,
+            html_parser=self.html_parser, segmenter=self.segmenter
+        )
+
+    def _memory_key(self, metadata):
+        return (metadata['title'], metadata.get('lastrevid'))
+
+    def _load_page(self, metadata, html):
+        if not self.cache or not self.cache_parsed:
+            return fragment.Fragment.parse(html, metadata=metadata, media_wiki=self, html_parser=self.html_parser)
+
+        # If HTML was refetched (or other HTML parser is used), the stored pre-parsed page would be
+        # ignored by the hash mismatch
         real_title = metadata['title']
+        source_hash = hashlib.sha1(html.encode('utf-8')).hexdigest() + ':' + self.html_parser
+        parsed = self.cache_get(real_title, format='parsed')
+        page = parsed and fragment.Fragment.load(parsed, source_hash=source_hash, metadata=metadata, media_wiki=self)
+        if page is None:
+            page = fragment.Fragment.parse(html, metadata=metadata, media_wiki=self, html_parser=self.html_parser)
+            self.cache_put(real_title, data=page.dump(source_hash=source_hash), format='parsed')
 
-        text_data = self.cache_get(real_title, format='html')
-        if not text_data:
-            response = self.__page_get(real_title)
-            text_data = response.content.decode('utf-8')
-            self.cache_put(real_title, text=text_data, format='html')
+        return page
 
-        return fragment.Fragment.parse(text_data, metadata=metadata, media_wiki=self)
+    BINARY_CACHE_FORMATS = ('parsed',)
 
     def cache_get(self, key, *, format='json'):
-        if not self.cache_folder:
+        if not self.cache:
             return
 
-        key = re.sub(r'[?\/&]', '-', key)
-        path = self.cache_folder.joinpath(f'{key}.{format}')
-        if path.exists():
-            content = path.read_text()
-            if format == 'json':
-                return json.loads(content)
-            else:
-                return content
+        content = self.cache.get(key, format=format, binary=format in self.BINARY_CACHE_FORMATS)
+        if content is not None and format == 'json':
+            return json.loads(content)
+        return content
 
-    def cache_put(self, key, *, text=None, json_data=None, format='json'):
-        if not self.cache_folder:
+    def cache_put(self, key, *, text=None, json_data=None, data=None, format='json', revision=None, etag=None):
+        if not self.cache:
             return
 
-        key = re.sub(r'[?\/&]', '-', key)
-        path = self.cache_folder.joinpath(f'{key}.{format}')
         if json_data:
             text = json.dumps(json_data)
-        path.write_text(text)
+        self.cache.put(key, text if data is None else data, format=format, revision=revision, etag=etag)
 
     # URI services:
     def absoluteize_uri(self, uri):
@@ -142,13 +443,105 @@ class Wikipedia:
         return urllib.parse.unquote(uri.replace('https://en.wikipedia.org/wiki/', ''))
 
     # Real fetching
+    def _make_session(self, *, retries, backoff_factor):
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util import Retry
+
+        # One keep-alive connection pool per host, large enough for all the fetching workers to
+        # use their own connection.
+        adapter = HTTPAdapter(
+            pool_connections=2, # Action API & Parsoid API hosts
+            pool_maxsize=max(self.workers, 1),
+            max_retries=Retry(
+                total=retries,
+                backoff_factor=backoff_factor,
+                status_forcelist=self.RETRY_STATUSES,
+                # Otherwise, urllib3 would retry 429s by itself, and they'd never reach the scheduler
+                respect_retry_after_header=False,
+                raise_on_status=False # Just return the last response when retries are exhausted
+            )
+        )
+        session = requests.Session()
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+
     def __query_get(self, **params):
-        return requests.get(
-            self.API_URI,
-            params={**params, **self.QUERY_PARAMS},
-            headers={'User-Agent': self.user_agent})
+        if self.maxlag is not None:
+            params = {**params, 'maxlag': self.maxlag}
+        return self.__get(self.API_URI, params={**params, **self.QUERY_PARAMS})
 
-    def __page_get(self, title):
-        return requests.get(
+    def __page_get(self, title, *, etag=None):
+        return self.__get(
             self.PARSOID_API_URI + urllib.parse.quote(title.replace(' ', '_')),
-            headers={'User-Agent': self.user_agent})
+            headers={'If-None-Match': etag} if etag else {}
+        )
+
+    def __get(self, uri, *, params=None, headers={}):
+        # Throttled requests are repeated after the pause the scheduler decides on
+        for _ in range(self.retries + 1):
+            with self.scheduler.slot(uri):
+                started = time.monotonic()
+                response = self.session.get(uri, params=params, headers={**headers, 'User-Agent': self.user_agent})
+                throttled = self.scheduler.observe(uri, response, time.monotonic() - started)
+            if not throttled:
+                return response
+
+        # Otherwise, callers would try to make sense of the throttling response's body
+        import requests
+        raise requests.HTTPError(
+            f'Request to {uri} was still throttled after {self.retries + 1} attempts', response=response
+        )
+
+
+def bounded_map(func, items, *, workers, ordered=True, executor=ThreadPoolExecutor, **executor_options):
+    """
+    Like ``map(func, items)``, but runs up to ``workers`` calls in threads simultaneously. Items are
+    consumed lazily, with no more than ``2 * workers`` calls scheduled at once, so it is suitable for
+    long (or infinite) generators. With ``ordered=False``, results are yielded as soon as they are ready.
+
+    ``executor=ProcessPoolExecutor`` (plus its ``executor_options``, like ``initializer``) allows to run
+    calls in processes instead.
+    """
+    if workers <= 1:
+        yield from map(func, items)
+        return
+
+    items = iter(items)
+    window = workers * 2
+    with executor(max_workers=workers, **executor_options) as executor:
+        pending = deque(executor.submit(func, item) for item in itertools.islice(items, window))
+        while pending:
+            if ordered:
+                done = [pending.popleft()]
+            else:
+                finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                done = [future for future in pending if future in finished]
+                for future in done:
+                    pending.remove(future)
+
+            for future in done:
+                result = future.result()
+                # Schedule the next item before yielding, so the pool keeps working while the consumer does
+                pending.extend(executor.submit(func, item) for item in itertools.islice(items, 1))
+                yield result
+
+def chunked(items, size):
+    items = iter(items)
+    while True:
+        chunk = [*itertools.islice(items, size)]
+        if not chunk:
+            return
+        yield chunk
+
+# Worker process state for Wikipedia._query_in_processes: set up once by the pool initializer
+_worker = {}
+
+def _init_worker(options, scheduler_options, selector):
+    _worker['wikipedia'] = Wikipedia(**options, scheduler=Scheduler(**scheduler_options))
+    _worker['selector'] = selector
+
+def _query_chunk(pages):
+    wikipedia = _worker['wikipedia']
+    return [wikipedia._parse_page(metadata, html).query(_worker['selector']) for metadata, html in pages]
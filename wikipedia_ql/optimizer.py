@@ -0,0 +1,47 @@
+import re
+from dataclasses import dataclass
+from typing import Any, Tuple
+
+# Optimizations of the compiled selectors (see selector_base.compile), which don't change the results.
+
+@dataclass(frozen=True)
+class Shared:
+    """
+    Several branches of the alt group starting with the same step (selector without its name and nested
+    ones), like ``{ section[heading="X"] >> a; section[heading="X"] >> img }``: the step is run once per
+    fragment, and the branches' nested selectors are run on the fragments it returns (sharing their own
+    common steps in the same way, see ``plan``).
+    """
+    step: Any
+    members: Tuple[int, ...]  # indexes of the branches
+    nested: Tuple[Any, ...]   # plan for nested selectors of the members having them
+
+def plan(selectors):
+    """
+    Plan of running the list of selectors (branches of the alt group) on the same fragment: tuple of
+    the branches' indexes (run by themselves) and ``Shared`` groups, ordered by their first branch.
+    """
+    groups = {}
+    for idx, selector in enumerate(selectors):
+        key = selector.step_key()
+        groups.setdefault(idx if key is None else key, []).append(idx)
+
+    units = []
+    for members in groups.values():
+        if len(members) == 1:
+            units.append(members[0])
+        else:
+            nested = [selectors[idx].nested for idx in members if selectors[idx].nested]
+            units.append(Shared(step=selectors[members[0]], members=tuple(members), nested=plan(nested)))
+    return tuple(units)
+
+# Things that make regexp match depend on what's around the matched text
+CONTEXT_DEPENDENT = re.compile(r'[$^]|\\[bBAZ]|\(\?')
+
+def matches_anywhere_inside(pattern):
+    """
+    Whether the regexp ``pattern`` matching some part of the text means it also matches the same part
+    inside any larger text (so, if it doesn't match the larger text, it wouldn't match any of its
+    parts). That's true unless it has anchors, word boundaries or lookarounds.
+    """
+    return not CONTEXT_DEPENDENT.search(pattern)
@@ -1,3 +1,5 @@
+import copy
+import functools
 from pathlib import Path
 from lark import Lark
 import lark
@@ -5,23 +7,41 @@ import lark
 from wikipedia_ql import selectors as s
 
 class Parser:
+    # How many parsed queries are remembered (by their text); see parse_cached
+    CACHE_SIZE = 256
+
     def __init__(self):
-        # TODO: open_from_package (can't make it work for now?..)
-        self.lark = Lark.open(
-            Path(__file__).parent / 'wikipedia_ql.lark',
-            start=["query", "selector", "selectors"],
-            propagate_positions=True
-        )
+        self.lark = build_lark()
 
     def parse(self, source):
-        tree = self.lark.parse(source, start="query")
-        tree = ValueTransformer().transform(tree)
-        return Interpreter(source).visit(tree)
+        """
+        Parses the full query (``from ... { selectors }``) into ``(type, page, selector)``. Parsed
+        queries are cached by their text; the caller gets its own copy, which it is free to change.
+        """
+        return copy.deepcopy(parse_cached(self.lark, source, 'query'))
 
     def parse_selector(self, source):
-        tree = self.lark.parse(source, start="selectors")
-        tree = ValueTransformer().transform(tree)
-        return Interpreter(source).visit(tree)
+        return copy.deepcopy(parse_cached(self.lark, source, 'selectors'))
+
+@functools.lru_cache(maxsize=None)
+def build_lark():
+    # LALR parser is built once per process and shared by all the Parser instances; its tables are
+    # also cached between processes by Lark itself (in the temp folder)
+    # TODO: open_from_package (can't make it work for now?..)
+    return Lark.open(
+        Path(__file__).parent / 'wikipedia_ql.lark',
+        start=["query", "selector", "selectors"],
+        parser='lalr',
+        propagate_positions=True,
+        cache=True
+    )
+
+# Selectors returned are shared by all the callers (see Parser.parse), so they shouldn't be changed
+@functools.lru_cache(maxsize=Parser.CACHE_SIZE)
+def parse_cached(lark_parser, source, start):
+    tree = lark_parser.parse(source, start=start)
+    tree = ValueTransformer().transform(tree)
+    return Interpreter(source).visit(tree)
 
 class ValueTransformer(lark.visitors.Transformer):
     def STRING(self, val):
@@ -2,7 +2,6 @@ import sys
 from optparse import OptionParser
 from pprint import pprint
 
-import yaml
 import json
 
 import wikipedia_ql
@@ -14,10 +13,19 @@ def run():
                       help=r'''Wikipedia page name to query. If absent, query should have form `from "Page Name" { ... }`''')
     parser.add_option("-o", "--output-format", dest="output_format", default='yaml',
                       help='One of "yaml" (default), "json" or "pprint" (python pretty-print).')
+    parser.add_option("-r", "--revalidate", dest="revalidate", action="store_const", const="always",
+                      default="never", help='Check if cached pages have changed on Wikipedia, and refetch them.')
+    parser.add_option("-s", "--segmenter", dest="segmenter", default="punkt",
+                      help='How to split text into sentences: "punkt" (NLTK, default) or "regex" (faster, no NLTK data needed).')
+    parser.add_option("--stream", dest="stream", action="store_true", default=False,
+                      help='Print each result as soon as it is found (as an item of YAML list, or a JSON line), instead of all of them at the end.')
+    parser.add_option("-d", "--dump", dest="dump",
+                      help='Path to Wikimedia Enterprise HTML dump (.tar.gz or .ndjson) to run the query (without `from`) on each of its articles, instead of fetching pages.')
+    parser.add_option("--processes", dest="processes", type="int",
+                      help='Number of processes to query dump (by default, number of CPUs) or category pages (by default, in this process) with.')
 
     # TODO: cache folder
     # TODO: --time
-    # TODO: force-cache-update
 
     options, args = parser.parse_args()
     if len(args) != 1:
@@ -26,7 +34,22 @@ def run():
 
     query = args[0]
 
-    wikipedia = wikipedia_ql.media_wiki.Wikipedia(cache_folder='tmp/cache/')
+    if options.dump:
+        from wikipedia_ql.dumps import Dump
+
+        # Articles results are printed as soon as they are ready, as a list of {title, result}
+        for metadata, result in Dump(options.dump).query(query, processes=options.processes, segmenter=options.segmenter):
+            if result:
+                output({'title': metadata['title'], 'result': result}, options.output_format, stream=True)
+        return
+
+    wikipedia = wikipedia_ql.media_wiki.Wikipedia(cache_folder='tmp/cache/', revalidate=options.revalidate,
+                                                  segmenter=options.segmenter, processes=options.processes)
+
+    if options.stream:
+        for result in wikipedia.stream(query, page=options.page):
+            output(result, options.output_format, stream=True)
+        return
 
     if options.page:
         result = wikipedia.query(query, page=options.page)
@@ -35,9 +58,17 @@ def run():
 
     print()
 
-    if options.output_format == 'yaml':
-      print(yaml.safe_dump(result, allow_unicode=True, width=1000, default_style='>'))
-    elif options.output_format == 'json':
-      print(json.dumps(result, ensure_ascii=False))
+    output(result, options.output_format)
+
+# In stream mode, each result is printed as an item of a YAML list, or a JSON line
+def output(result, format, *, stream=False):
+    if format == 'yaml':
+      import yaml # Not imported when not needed: it takes a while
+      if stream:
+        print(yaml.safe_dump([result], allow_unicode=True, width=1000, default_style='>'), end='', flush=True)
+      else:
+        print(yaml.safe_dump(result, allow_unicode=True, width=1000, default_style='>'))
+    elif format == 'json':
+      print(json.dumps(result, ensure_ascii=False), flush=stream)
     else:
       pprint(result)
@@ -0,0 +1,158 @@
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+import threading
+import time
+import urllib.parse
+
+class TokenBucket:
+    """
+    Allows ``rate`` requests per second on average, with bursts of up to ``rate`` (but at least one)
+    requests. Thread-safe.
+    """
+    def __init__(self, rate):
+        self.rate = rate
+        self.tokens = 1.0
+        self.updated = time.monotonic()
+        self.paused_until = 0
+        self.lock = threading.Lock()
+
+    def take(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(max(self.rate, 1.0), self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+
+                wait = self.paused_until - now
+                if wait <= 0:
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.tokens = 0.0
+
+
+class Scheduler:
+    """
+    Politeness layer for the HTTP requests: every request should be made inside ``slot(url)``, and its
+    response passed to ``observe``.
+
+    * Each host has its own token bucket, limiting the request rate;
+    * the rate and the number of simultaneous requests (up to ``max_concurrency``) are adjusted by
+      responses: throttling (HTTP 429 or API's maxlag error) halves them and pauses the host for
+      ``Retry-After`` seconds, successful responses slowly increase them back, slow responses decrease
+      concurrency.
+    """
+    def __init__(self, *, rate=10.0, min_rate=0.5, max_rate=50.0, rate_step=0.1,
+                 max_concurrency=4, min_concurrency=1, slow_response=5.0, default_pause=1.0):
+        self.initial_rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.rate_step = rate_step
+
+        self.max_concurrency = max(max_concurrency, min_concurrency)
+        self.min_concurrency = min_concurrency
+        self.concurrency = self.max_concurrency
+
+        self.slow_response = slow_response
+        self.default_pause = default_pause
+
+        self.buckets = {}
+        self.active = 0
+        self.successes = 0
+        self.throttled = 0
+        self.condition = threading.Condition()
+
+    def share(self, parts):
+        """
+        Settings (``Scheduler`` arguments) of a scheduler allowed ``1/parts`` of this one's request rate and
+        concurrency, for the worker processes that can't share it.
+        """
+        return dict(
+            rate=self.initial_rate / parts, min_rate=self.min_rate / parts, max_rate=self.max_rate / parts,
+            rate_step=self.rate_step / parts,
+            max_concurrency=max(self.max_concurrency // parts, 1), min_concurrency=1,
+            slow_response=self.slow_response, default_pause=self.default_pause
+        )
+
+    @property
+    def rates(self):
+        """Current allowed request rate (per second) for each host seen."""
+        return {host: bucket.rate for host, bucket in self.buckets.items()}
+
+    def rate(self, url):
+        return self._bucket(url).rate
+
+    @contextmanager
+    def slot(self, url):
+        with self.condition:
+            while self.active >= self.concurrency:
+                self.condition.wait()
+            self.active += 1
+
+        try:
+            self._bucket(url).take()
+            yield
+        finally:
+            with self.condition:
+                self.active -= 1
+                self.condition.notify()
+
+    def observe(self, url, response, elapsed):
+        """
+        Adjusts the limits by the response; returns ``True`` if the response is throttling one, and the
+        request should be repeated.
+        """
+        bucket = self._bucket(url)
+        throttled = is_throttled(response)
+
+        with self.condition:
+            if throttled:
+                self.throttled += 1
+                bucket.pause(retry_after(response, self.default_pause))
+                bucket.rate = max(self.min_rate, bucket.rate / 2)
+                self.concurrency = max(self.min_concurrency, self.concurrency // 2)
+                self.successes = 0
+            elif elapsed > self.slow_response:
+                self.concurrency = max(self.min_concurrency, self.concurrency - 1)
+                self.successes = 0
+            else:
+                bucket.rate = min(self.max_rate, bucket.rate + self.rate_step)
+                self.successes += 1
+                # Widen only after a "window" of successful responses at the current concurrency
+                if self.successes >= self.concurrency * 10:
+                    self.concurrency = min(self.max_concurrency, self.concurrency + 1)
+                    self.successes = 0
+
+            self.condition.notify_all()
+
+        return throttled
+
+    def _bucket(self, url):
+        host = urllib.parse.urlparse(url).netloc
+        with self.condition:
+            if host not in self.buckets:
+                self.buckets[host] = TokenBucket(self.initial_rate)
+            return self.buckets[host]
+
+
+def is_throttled(response):
+    # MediaWiki API reports maxlag errors with HTTP 200, but with a special header
+    return response.status_code == 429 or response.headers.get('MediaWiki-API-Error') == 'maxlag'
+
+def retry_after(response, default):
+    value = response.headers.get('Retry-After')
+    if not value:
+        return default
+    if value.isdigit():
+        return int(value)
+    try:
+        return max(0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return default
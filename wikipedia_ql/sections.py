@@ -0,0 +1,74 @@
+from bisect import bisect_left
+from dataclasses import dataclass
+from typing import Optional
+
+HEADINGS = frozenset(['h2', 'h3', 'h4'])
+
+@dataclass(frozen=True)
+class Section:
+    node: int                 # index of the <section> in the text tree
+    heading: Optional[str]    # text of its heading, None for the sections without one (like the lead)
+    level: Optional[int]      # 2 for <h2>, and so on
+    parent: int               # node of the section it is nested in, or -1
+
+class SectionIndex:
+    """
+    All the ``<section>`` tags of the document (that's how Parsoid HTML marks up the page's sections),
+    with their headings, levels and nesting, found in one pass through the text tree. Lookups by
+    heading are dictionary hits, computed once per heading asked.
+    """
+    def __init__(self, tree):
+        nodes = tree.nodes
+        sections = []
+        headings = []
+        for idx, node in enumerate(nodes):
+            if node.name == 'section':
+                sections.append(idx)
+            elif node.name in HEADINGS:
+                headings.append(idx)
+
+        self.sections = []
+        self.by_node = {}
+        for idx in sections:
+            # Section's heading is the first heading inside it (same as section.select_one('h2, h3, h4'))
+            pos = bisect_left(headings, idx)
+            heading = headings[pos] if pos < len(headings) and headings[pos] < tree.subtree_end(idx) else None
+
+            parent = tree.parents[idx]
+            while parent != -1 and parent not in self.by_node:
+                parent = tree.parents[parent]
+
+            section = Section(
+                node=idx,
+                heading=None if heading is None else nodes[heading].get_text(),
+                level=None if heading is None else int(nodes[heading].name[1]),
+                parent=parent
+            )
+            self.sections.append(section)
+            self.by_node[idx] = section
+
+        self.by_heading = {}  # heading text => nodes of sections having it
+        for section in self.sections:
+            if section.heading is not None:
+                self.by_heading.setdefault(section.heading, []).append(section.node)
+
+        self._found = {}
+
+    def find(self, *, heading=None, level=None):
+        """
+        Nodes of the sections (in document order) which heading contains ``heading``, and of ``level``
+        (either is optional).
+        """
+        key = (heading, level)
+        if key not in self._found:
+            if heading is None:
+                found = [section.node for section in self.sections]
+            else:
+                # Heading is matched as a substring, so several distinct headings might contain it
+                found = sorted(
+                    node for text, nodes in self.by_heading.items() if heading in text for node in nodes
+                )
+            if level is not None:
+                found = [node for node in found if self.by_node[node].level == level]
+            self._found[key] = found
+        return self._found[key]
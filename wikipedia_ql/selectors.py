@@ -1,4 +1,6 @@
+import copy
 import re
+from types import MappingProxyType
 import bs4
 import soupsieve
 
@@ -6,6 +8,7 @@ from dataclasses import dataclass, field
 from typing import Any, Union, Dict, List, Optional
 
 import wikipedia_ql.tables
+from wikipedia_ql import optimizer
 
 @dataclass
 class selector_base:
@@ -20,6 +23,48 @@ class selector_base:
         self.attrs = attrs
         self.functions = functions
 
+    # Set on the execution plan made by compile(), which can't be changed anymore
+    compiled = False
+
+    def compile(self):
+        """
+        Execution plan of the selector: its copy with everything not depending on the page (regexps, CSS
+        selectors, functions' values) prepared once, and nested selectors compiled too. The plan is
+        immutable, so it can be reused for any number of pages.
+        """
+        if self.compiled:
+            return self
+        plan = copy.copy(self)
+        # Read-only, so they can't get out of sync with what was prepared from them
+        plan.attrs = MappingProxyType(dict(self.attrs))
+        plan.functions = MappingProxyType(dict(self.functions))
+        plan.nested = self.nested.compile() if self.nested else None
+        plan.prepare()
+        object.__setattr__(plan, 'compiled', True)
+        return plan
+
+    def prepare(self):
+        pass
+
+    def step_key(self):
+        # What the selector does by itself (regardless of its name and nested selectors): the branches
+        # starting with the same step share it (see optimizer.plan)
+        return (type(self), tuple(sorted(self.attrs.items())), tuple(sorted(self.functions.items())))
+
+    def __setattr__(self, name, value):
+        if self.compiled:
+            raise AttributeError(f'Compiled selector {self!r} can not be changed')
+        super().__setattr__(name, value)
+
+    # Plans are sent to worker processes, and mappingproxy can't be pickled
+    def __getstate__(self):
+        return {**self.__dict__, 'attrs': dict(self.attrs), 'functions': dict(self.functions)}
+
+    def __setstate__(self, state):
+        if state.get('compiled'):
+            state = {**state, 'attrs': MappingProxyType(state['attrs']), 'functions': MappingProxyType(state['functions'])}
+        self.__dict__.update(state)
+
     def __repr__(self):
         return type(self).__name__ + \
             ''.join(f'[{name}={value!r}]' for name, value in self.attrs.items()) + \
@@ -28,11 +73,9 @@ class selector_base:
             (f' >> {self.nested!r}' if self.nested else '')
 
 class text(selector_base):
-    @property
-    def re(self):
+    def prepare(self):
         pat = self.functions.get('matches')
-        if pat:
-            return re.compile(pat, re.MULTILINE | re.DOTALL)
+        self.re = re.compile(pat, re.MULTILINE | re.DOTALL) if pat else None
 
     def __call__(self, fragment):
         if self.re:
@@ -60,18 +103,21 @@ class text_group(selector_base):
         yield page.slice(s - match.start(), e - match.start())
 
 class sentence(selector_base):
-    @property
-    def re(self):
+    def prepare(self):
         pat = self.functions.get('contains')
-        if pat:
-            return re.compile(pat)
+        self.re = re.compile(pat) if pat else None
+        # Lines of text where the pattern isn't found don't need to be split into sentences (unless we
+        # need to count sentences for :first)
+        self.line_filter = None
+        if self.re and not self.functions.get('first') and optimizer.matches_anywhere_inside(pat):
+            self.line_filter = self.re.search
 
     def __call__(self, fragment):
-        yield from (
-            fragment.slice(start, end)
-            for (idx, (text, start, end)) in enumerate(fragment.sentences)
-            if self.matches(text, idx)
-        )
+        for idx, (text, start, end) in enumerate(fragment.iter_sentences(line_filter=self.line_filter)):
+            if self.matches(text, idx):
+                yield fragment.slice(start, end)
+            if self.functions.get('first') == True:
+                break
 
     def matches(self, text, idx):
         res = True
@@ -89,14 +135,20 @@ class section(selector_base):
     def heading(self):
         return self.attrs.get('heading')
 
-    # TODO: Level as an optional filter; No filters at all (select all sections)
+    @property
+    def level(self):
+        return self.functions.get('level')
+
     def __call__(self, fragment):
-        for idx, section in enumerate(fragment.soup.select('section')):
-            heading = section.select_one('h2, h3, h4')
-            # TODO: generalize :first
-            if (not self.heading or heading and self.heading in heading.get_text()) and \
-               (not self.functions.get('first') or idx==0):
-                yield fragment.slice_tags([*section.children])
+        nodes = fragment.sections(level=self.level)
+        # TODO: generalize :first
+        if self.functions.get('first'):
+            nodes = nodes[:1]
+        if self.heading:
+            # Heading lookups are cached by the page's section index
+            matching = set(fragment.sections(heading=self.heading, level=self.level))
+            nodes = [node for node in nodes if node in matching]
+        yield from (fragment.children_fragment(node) for node in nodes)
 
     # This is more generic section fetching algo (relying on Wikipedia page structure with just hX at top level);
     # it doesn't work with Parsoid output (which made things easier), but might be useful if we'll parse other
@@ -126,14 +178,16 @@ class css(selector_base):
     def css_selector(self):
         return self.attrs['css_selector']
 
+    def prepare(self):
+        self.selector = soupsieve.compile(self.css_selector)
+
     def __call__(self, page):
         # Handles the corner case when the current fragment's top node is the match, e.g.
         #   from ...<a>foo</a>...
         #    text["foo"] >> a
-        # FIXME: Isn't there a way to ask bs to do this?..
-        if soupsieve.match(self.css_selector, page.soup):
+        if page.matches(self.selector):
             yield page
-        yield from (page.slice_tags([node]) for node in page.soup.select(self.css_selector))
+        yield from (page.node_fragment(node) for node in page.select_nodes(self.selector))
 
 # Quasi-fragment returned by attr() selector: it is only good for getting text out of it
 @dataclass
@@ -145,6 +199,12 @@ class attr(selector_base):
     def attr_name(self):
         return self.attrs['attr_name']
 
+    def prepare(self):
+        self.style_re = None
+        if self.attr_name.startswith('style-'):
+            prop = self.attr_name.replace('style-', '')
+            self.style_re = re.compile(f'{prop}:\\s*(.+?)(;|$)')
+
     def __call__(self, fragment):
         value = None
 
@@ -153,15 +213,14 @@ class attr(selector_base):
         # * not raise on not found attr
         if fragment.type == 'page':
             value = fragment.metadata.get(self.attr_name)
-        elif self.attr_name.startswith('style-'):
-            style = fragment.soup.get('style')
+        elif self.style_re:
+            style = fragment.node.get('style')
             if style:
-                prop = self.attr_name.replace('style-', '')
-                match = re.search(f'{prop}:\\s*(.+?)(;|$)', style)
+                match = self.style_re.search(style)
                 if match:
                     value = match.group(1)
         else:
-            value = fragment.soup.get(self.attr_name)
+            value = fragment.node.get(self.attr_name)
             if value and (self.attr_name == 'href' or self.attr_name == 'src') and fragment.media_wiki:
                 value = fragment.media_wiki.absoluteize_uri(value)
 
@@ -174,9 +233,13 @@ class page(selector_base):
         yield page.page
 
 class follow_link(selector_base):
+    def prepare(self):
+        # a@href
+        self.links = css(attrs={'css_selector': 'a'}, nested=attr(attrs={'attr_name': 'href'})).compile()
+
     def __call__(self, fragment):
         # TODO: Make it async (and have a queue of pages to fetch)?
-        page_names = filter(None, [fragment.media_wiki.page_name_from_uri(href) for href in fragment.query('a@href')])
+        page_names = filter(None, [fragment.media_wiki.page_name_from_uri(href) for href in fragment.query(self.links)])
         yield from fragment.media_wiki.get_pages(page_names)
 
 class table_data(selector_base):
@@ -185,7 +248,7 @@ class table_data(selector_base):
         return self.functions.get('force-row-headers')
 
     def __call__(self, fragment):
-        if fragment.type == 'page' or fragment.soup.name != 'table':
+        if fragment.type == 'page' or fragment.node.name != 'table':
             raise ValueError('table-data should be nested in a table directly')
 
         table = wikipedia_ql.tables.reflow(fragment.soup, force_row_headers=self.force_row_headers)
@@ -197,9 +260,28 @@ class alt:
     # To correspond to other selectors' attributes
     nested=None
 
+    compiled = False
+
     def __init__(self, *selectors):
         self.selectors = selectors
 
+    def compile(self):
+        if self.compiled:
+            return self
+        plan = alt(*(selector.compile() for selector in self.selectors))
+        # How to run the branches sharing their common steps, see fragment.query
+        plan.branches = optimizer.plan(plan.selectors)
+        plan.compiled = True
+        return plan
+
+    def step_key(self):
+        return None
+
+    def __setattr__(self, name, value):
+        if self.compiled:
+            raise AttributeError(f'Compiled selector {self!r} can not be changed')
+        super().__setattr__(name, value)
+
     def __call__(self, page):
         yield from (fragment for selector in self.selectors for fragment in selector(page))
 
@@ -0,0 +1,117 @@
+from array import array
+from bisect import bisect_right
+import functools
+import re
+
+# Segmenter is anything having span_tokenize(text) method, returning (start, end) of the text's
+# sentences (like NLTK's tokenizers). Built-in ones are selected by name: see get_segmenter.
+
+def punkt():
+    # NLTK's punkt model: most accurate, but slow, and requires NLTK data to be downloaded. NLTK
+    # itself takes a while to import, so it is only imported when sentences are needed
+    import nltk.data
+    return nltk.data.load('tokenizers/punkt/english.pickle')
+
+class RegexSegmenter:
+    """
+    Fast rule-based segmenter tuned for Wikipedia texts. Sentence ends with ``.``, ``!``, ``?`` or ``…``
+    (possibly followed by closing quotes and brackets, and citation marks like ``[1]`` or
+    ``[citation needed]``), then spaces and a capital letter, digit or opening quote. Except when the
+    period ends a known abbreviation (``Dr.``, ``e.g.``, ``U.S.``) or an initial (``J. R. R. Tolkien``).
+    Decimal numbers have no space after the period, so they aren't split, either.
+    """
+    ABBREVIATIONS = frozenset([
+        'mr', 'mrs', 'ms', 'dr', 'prof', 'st', 'jr', 'sr', 'rev', 'hon', 'gen', 'gov', 'sen', 'rep',
+        'pres', 'lt', 'col', 'capt', 'cpt', 'sgt', 'maj', 'adm', 'cmdr', 'mt', 'ft', 'fr', 'br',
+        'vs', 'etc', 'cf', 'al', 'approx', 'ca', 'fl', 'no', 'nos', 'vol', 'vols', 'pp', 'ch', 'fig', 'ed', 'eds', 'trans', 'inc', 'ltd', 'co', 'corp', 'bros', 'dept', 'univ',
+        'est', 'op', 'jan', 'feb', 'mar', 'apr', 'jun', 'jul', 'aug', 'sep', 'sept', 'oct', 'nov', 'dec',
+    ])
+    CANDIDATE = re.compile(r"""
+        [.!?…]+                                 # terminator
+        (?: ["'”’»)\]] | \[[^\[\]]{1,30}\] )*     # closing quotes and brackets, citation marks
+        (?=\s+(\S))                              # followed by the next word
+    """, re.VERBOSE)
+    OPENERS = '"\'“‘«(['
+
+    def span_tokenize(self, text):
+        start = len(text) - len(text.lstrip())
+        for match in self.CANDIDATE.finditer(text):
+            following = match.group(1)
+            if not (following.isupper() or following.isdigit() or following in self.OPENERS):
+                continue
+            if text[match.start()] == '.' and self.is_abbreviation(text, start, match.start()):
+                continue
+            yield (start, match.end())
+            start = match.start(1)
+
+        end = len(text.rstrip())
+        if start < end:
+            yield (start, end)
+
+    def is_abbreviation(self, text, start, period):
+        word = text[max(text.rfind(' ', start, period) + 1, start):period].lstrip(self.OPENERS)
+        if len(word) == 1 and word.isalpha():
+            return True # initial
+        # U.S., e.g., Ph.D.
+        return word.lower() in self.ABBREVIATIONS or '.' in word and word.replace('.', '').isalpha()
+
+SEGMENTERS = {
+    'punkt': punkt,
+    'regex': RegexSegmenter,
+}
+
+@functools.lru_cache(maxsize=None)
+def load_segmenter(name):
+    # Loading punkt's model takes a while, so it is done once per process
+    if name not in SEGMENTERS:
+        raise ValueError(f'Unknown sentence segmenter {name!r}, available are: {", ".join(SEGMENTERS)}')
+    return SEGMENTERS[name]()
+
+def get_segmenter(segmenter):
+    """
+    Segmenter by name (``"punkt"`` or ``"regex"``, see ``RegexSegmenter``), or the object itself.
+    """
+    return load_segmenter(segmenter) if isinstance(segmenter, str) else segmenter
+
+class SentenceIndex:
+    """
+    Sentences of the document's text, shared by all of its fragments. Sentences never cross the line
+    boundaries, so the text is tokenized line by line, and only the lines some fragment asked about.
+    """
+    def __init__(self, text, tokenizer):
+        self.text = text
+        self.tokenizer = tokenizer
+        self.line_starts = array('i', [0, *(match.end() for match in re.finditer('\n', text))])
+        self.lines = {} # line number => [(start, end) of sentences in the document's text]
+
+    def sentences(self, start, end, *, line_filter=None):
+        """
+        Yields ``(start, end)`` of the sentences inside the ``[start, end)`` range of the document's text;
+        the ones the range cuts through are clipped to it. Lines for which ``line_filter(line_text)``
+        is false are skipped without tokenizing.
+        """
+        text = self.text
+        for line in range(bisect_right(self.line_starts, start) - 1, bisect_right(self.line_starts, end)):
+            if line_filter and line not in self.lines:
+                line_start, line_end = self.line_span(line)
+                if not line_filter(text[line_start:line_end]):
+                    continue
+            for s, e in self.line_sentences(line):
+                if e <= start:
+                    continue
+                if s >= end:
+                    return
+                s, e = max(s, start), min(e, end)
+                if s < e:
+                    yield (s, e)
+
+    def line_span(self, line):
+        start = self.line_starts[line]
+        end = self.line_starts[line + 1] - 1 if line + 1 < len(self.line_starts) else len(self.text)
+        return start, end
+
+    def line_sentences(self, line):
+        if line not in self.lines:
+            start, end = self.line_span(line)
+            self.lines[line] = [(start + s, start + e) for s, e in self.tokenizer.span_tokenize(self.text[start:end])]
+        return self.lines[line]
@@ -0,0 +1,85 @@
+import marshal
+
+import bs4
+from bs4.builder import HTMLParserTreeBuilder
+
+from wikipedia_ql.text_tree import TextTree
+
+# Compact representation of the parsed page, to be stored in cache alongside the page HTML: loading it
+# is several times faster than parsing HTML again (and building page text).
+#
+# The soup is stored as a flat list of nodes in document order: (name, attrs, number of children)
+# for tags, and (string class name, text) for strings; which allows to build the tree back with
+# bs4 objects directly, without going through HTML tokenizing and tree building. The text tree nodes
+# are in the same order, so only its columns are stored.
+
+# Should be increased on every change of the format (or of the Fragment's text/text_tree structure)
+FORMAT_VERSION = 2
+
+def dump(soup, text_tree, *, source_hash=None):
+    return marshal.dumps((FORMAT_VERSION, source_hash, dump_soup(soup), text_tree.text, text_tree.dump()))
+
+def load(data, *, source_hash=None):
+    """
+    Returns ``(soup, text_tree)``, or ``None`` if the data is of other format version or was
+    produced from different source.
+    """
+    version, stored_hash, nodes, text, text_tree = marshal.loads(data)
+    if version != FORMAT_VERSION or stored_hash != source_hash:
+        return None
+    nodes = load_soup(nodes)
+    return (nodes[0], TextTree.load(nodes, text, text_tree))
+
+def dump_soup(root):
+    nodes = []
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, bs4.element.NavigableString):
+            nodes.append((type(node).__name__, str(node)))
+        else:
+            # Multi-valued attributes (class) are joined back, as they were in HTML
+            attrs = {name: ' '.join(value) if isinstance(value, list) else value for name, value in node.attrs.items()}
+            nodes.append((node.name, attrs, len(node.contents)))
+            stack.extend(reversed(node.contents))
+
+    return nodes
+
+def load_soup(nodes):
+    builder = HTMLParserTreeBuilder()
+
+    loaded = []
+    parents = [] # [tag, number of children left to attach]
+    previous = None
+    for entry in nodes:
+        if len(entry) == 2:
+            string_class, text = entry
+            node = getattr(bs4.element, string_class, bs4.element.NavigableString)(text)
+            children_count = 0
+        else:
+            name, attrs, children_count = entry
+            node = bs4.element.Tag(None, builder, name, attrs=attrs)
+
+        # Everything the bs4 tree builder would set up for the node
+        if parents:
+            parent = parents[-1]
+            node.parent = parent[0]
+            siblings = parent[0].contents
+            if siblings:
+                siblings[-1].next_sibling = node
+                node.previous_sibling = siblings[-1]
+            siblings.append(node)
+            parent[1] -= 1
+        if previous is not None:
+            previous.next_element = node
+            node.previous_element = previous
+        previous = node
+        loaded.append(node)
+
+        if children_count:
+            parents.append([node, children_count])
+        while parents and parents[-1][1] == 0:
+            parents.pop()
+
+    # All nodes in document order
+    return loaded
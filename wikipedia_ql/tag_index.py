@@ -0,0 +1,92 @@
+import functools
+import re
+from dataclasses import dataclass
+from typing import FrozenSet, Optional
+
+import bs4
+
+@dataclass(frozen=True)
+class SimpleSelector:
+    """
+    CSS selector that only checks the tag's own name, id and classes, like ``a``, ``table.wikitable``,
+    ``#toc`` or ``*``: such selectors are answered by ``TagIndex`` instead of soupsieve.
+    """
+    name: Optional[str] = None  # None for any
+    id: Optional[str] = None
+    classes: FrozenSet[str] = frozenset()
+
+    def match(self, node):
+        return isinstance(node, bs4.element.Tag) and \
+            (self.name is None or node.name == self.name) and \
+            (self.id is None or node.get('id') == self.id) and \
+            self.classes.issubset(node.get('class') or ())
+
+NAME = r'[a-zA-Z][\w-]*'
+IDENT = r'-?[_a-zA-Z][\w-]*'
+SIMPLE = re.compile(rf'({NAME}|\*)?((?:[.#]{IDENT})*)')
+PARTS = re.compile(rf'([.#])({IDENT})')
+
+@functools.lru_cache(maxsize=256)
+def parse_simple(css_selector):
+    """
+    Tuple of ``SimpleSelector`` for the selector (or comma-separated list of them), or ``None`` if any
+    of them is more complicated than that (has attributes, pseudo-classes, combinators or escapes).
+    """
+    selectors = []
+    for part in css_selector.split(','):
+        match = SIMPLE.fullmatch(part.strip())
+        if not match or not any(match.groups()):
+            return None
+        name, rest = match.groups()
+        ids = set()
+        classes = set()
+        for kind, value in PARTS.findall(rest):
+            (ids if kind == '#' else classes).add(value)
+        if len(ids) > 1:
+            return None # never matches, but let soupsieve decide what to do with it
+        selectors.append(SimpleSelector(
+            name=None if name in (None, '*') else name.lower(),
+            id=next(iter(ids), None),
+            classes=frozenset(classes)
+        ))
+    return tuple(selectors)
+
+class TagIndex:
+    """
+    Tags of the document by name, class and id: lists of their indexes in the text tree, in document order.
+    """
+    def __init__(self, tree):
+        self.nodes = tree.nodes
+        self.tags = []
+        self.names = {}
+        self.classes = {}
+        self.ids = {}
+        for idx, node in enumerate(tree.nodes):
+            if not isinstance(node, bs4.element.Tag):
+                continue
+            self.tags.append(idx)
+            self.names.setdefault(node.name, []).append(idx)
+            for klass in set(node.get('class') or ()):
+                self.classes.setdefault(klass, []).append(idx)
+            if node.get('id') is not None:
+                self.ids.setdefault(node['id'], []).append(idx)
+        self._found = {}
+
+    def find(self, selectors):
+        """
+        Indexes of the tags matching any of the ``SimpleSelector``s, in document order.
+        """
+        if selectors not in self._found:
+            found = [self._find(selector) for selector in selectors]
+            self._found[selectors] = found[0] if len(found) == 1 else sorted(set().union(*found))
+        return self._found[selectors]
+
+    def _find(self, selector):
+        # The narrowest of the lists the tag should be in, then checking the rest
+        candidates = [self.tags]
+        if selector.name is not None:
+            candidates.append(self.names.get(selector.name, []))
+        if selector.id is not None:
+            candidates.append(self.ids.get(selector.id, []))
+        candidates.extend(self.classes.get(klass, []) for klass in selector.classes)
+        return [idx for idx in min(candidates, key=len) if selector.match(self.nodes[idx])]
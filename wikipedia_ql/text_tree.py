@@ -0,0 +1,196 @@
+from array import array
+from bisect import bisect_left, bisect_right
+
+import bs4
+
+NEWLINE_TAGS = frozenset(['p', 'div', 'ul', 'ol', 'li', 'table', 'tbody', 'tr', 'br', 'h2', 'h3', 'h4', 'h5'])
+
+class TextTree:
+    """
+    Text of the document (page, or standalone tree like reflowed table), and positions of its nodes
+    in it. Nodes are numbered in document order (the top node is 0), and everything about them is
+    stored in flat arrays indexed by that number: ``starts`` and ``ends`` of the node's text, and
+    ``parents``, ``first_children``, ``next_siblings`` (-1 where there is none) to navigate the tree.
+
+    All the fragments of the document share it, being just ranges of its text (see ``Fragment``); other
+    indexes of the document they need (like sentences) are built lazily and stored in ``indexes``.
+    """
+    __slots__ = ('nodes', 'text', 'starts', 'ends', 'parents', 'first_children', 'next_siblings', 'indexes', '_positions')
+
+    COLUMNS = ('starts', 'ends', 'parents', 'first_children', 'next_siblings')
+
+    def __init__(self, nodes=None, text='', *columns):
+        self.nodes = nodes or []
+        self.text = text
+        for name, column in zip(self.COLUMNS, columns or [array('i') for _ in self.COLUMNS]):
+            setattr(self, name, column)
+        self.indexes = {}
+        self._positions = None
+
+    @classmethod
+    def build(cls, root, *, remove=None):
+        """
+        Builds the tree for the node: the text of all strings inside it (with newlines after block tags),
+        and their positions in it. Tags for which ``remove(tag)`` is true are decomposed, and not
+        included in either.
+        """
+        tree = cls()
+
+        if isinstance(root, bs4.element.NavigableString):
+            tree.text = str(root).replace('\xa0', ' ')
+            tree.ends[tree._add(root, 0, -1, -1)] = len(tree.text)
+            return tree
+
+        chunks = []
+        length = 0
+        removed = []
+
+        # Iterative, so the deeply nested pages don't hit the recursion limit.
+        # Stack entries: [node index, iterator through node's children, index of the last added child]
+        stack = [[tree._add(root, 0, -1, -1), iter(root.contents), -1]]
+        while stack:
+            entry = stack[-1]
+            child = next(entry[1], None)
+            if child is None:
+                stack.pop()
+                if tree.nodes[entry[0]].name in NEWLINE_TAGS:
+                    chunks.append('\n')
+                    length += 1
+                tree.ends[entry[0]] = length
+            elif isinstance(child, bs4.element.NavigableString):
+                text = str(child).replace('\xa0', ' ')
+                entry[2] = idx = tree._add(child, length, entry[0], entry[2])
+                chunks.append(text)
+                length += len(text)
+                tree.ends[idx] = length
+            elif remove and remove(child):
+                removed.append(child) # not right now, so the list being iterated doesn't change
+            else:
+                entry[2] = idx = tree._add(child, length, entry[0], entry[2])
+                stack.append([idx, iter(child.contents), -1])
+
+        for tag in removed:
+            tag.decompose()
+
+        tree.text = ''.join(chunks)
+        return tree
+
+    def as_tuples(self, idx=0):
+        """
+        Nested ``(start, end, children)`` tuples of the node and its descendants: handy for debugging.
+        """
+        return (self.starts[idx], self.ends[idx], [self.as_tuples(child) for child in self.children(idx)])
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def span(self, idx):
+        return (self.starts[idx], self.ends[idx])
+
+    def children(self, idx):
+        child = self.first_children[idx]
+        while child != -1:
+            yield child
+            child = self.next_siblings[child]
+
+    def siblings(self, first, last):
+        idx = first
+        while idx != -1 and idx <= last:
+            yield idx
+            idx = self.next_siblings[idx]
+
+    def subtree_end(self, idx):
+        """
+        Index after the last descendant of the node.
+        """
+        while idx != -1:
+            if self.next_siblings[idx] != -1:
+                return self.next_siblings[idx]
+            idx = self.parents[idx]
+        return len(self.nodes)
+
+    def index(self, node):
+        """
+        Index of the bs4 node, or ``None`` if it is not in this tree.
+        """
+        if self._positions is None:
+            self._positions = {id(node): idx for idx, node in enumerate(self.nodes)}
+        idx = self._positions.get(id(node))
+        if idx is not None and self.nodes[idx] is node:
+            return idx
+
+    def includes(self, idx, start, end):
+        """
+        Whether the node belongs to the ``[start, end)`` range of text: is fully covered by it, or
+        overlaps it at least by one character.
+        """
+        s, e = self.starts[idx], self.ends[idx]
+        return start <= s and e <= end or max(s, start) < min(e, end)
+
+    def children_within(self, idx, start, end):
+        """
+        Children of the node included into the ``[start, end)`` range (see ``includes``). Nodes are in
+        document order, so their starts are sorted, and the first of the children is found with binary
+        search: the cost depends on the number of children returned, not the size of the node.
+        """
+        child = self.first_children[idx]
+        if child != -1 and self.starts[child] < start:
+            # The last node inside this one which starts before the range, and its ancestor which is
+            # this node's child
+            child = bisect_left(self.starts, start, idx + 1) - 1
+            while child != -1 and self.parents[child] != idx:
+                child = self.parents[child]
+
+        while child != -1:
+            s, e = self.starts[child], self.ends[child]
+            if s > end or s == end and e > end:
+                break
+            if self.includes(child, start, end):
+                yield child
+            child = self.next_siblings[child]
+
+    def nodes_within(self, lo, hi, start, end):
+        """
+        Nodes with indexes from ``lo`` to ``hi`` (all the nodes inside some node, or several siblings)
+        included into the ``[start, end)`` range, in document order.
+        """
+        first = bisect_left(self.starts, start, lo, hi)
+
+        # The nodes starting before the range but overlapping it are ancestors of the last of them
+        ancestors = []
+        idx = first - 1
+        while idx >= lo:
+            if self.includes(idx, start, end):
+                ancestors.append(idx)
+            idx = self.parents[idx]
+        yield from reversed(ancestors)
+
+        for idx in range(first, bisect_right(self.starts, end, first, hi)):
+            if self.includes(idx, start, end):
+                yield idx
+
+    def dump(self):
+        return tuple(getattr(self, name).tobytes() for name in self.COLUMNS)
+
+    @classmethod
+    def load(cls, nodes, text, data):
+        columns = []
+        for column_data in data:
+            column = array('i')
+            column.frombytes(column_data)
+            columns.append(column)
+        return cls(nodes, text, *columns)
+
+    def _add(self, node, start, parent, previous):
+        idx = len(self.nodes)
+        self.nodes.append(node)
+        self.starts.append(start)
+        self.ends.append(start)
+        self.parents.append(parent)
+        self.first_children.append(-1)
+        self.next_siblings.append(-1)
+        if previous != -1:
+            self.next_siblings[previous] = idx
+        elif parent != -1:
+            self.first_children[parent] = idx
+        return idx